@@ -1,3 +1,12 @@
+import array
+import bisect
+import numpy as np
+
+
+def _endpoint(x):
+    # endpoints read back from the float arrays of an IntervalsSet, with integral ones as
+    # int so that they are printed as given, e.g. [0, 1] rather than [0.0, 1.0]
+    return int(x) if x.is_integer() else x
 
 
 class Interval:
@@ -6,9 +15,11 @@ class Interval:
     Attributes:
         left (float): The left endpoint of the interval.
         right (float): The right endpoint of the interval.
-        string (str): String representation of the interval.
+        string (str): String representation of the interval. Computed on first access.
     """
 
+    __slots__ = ('left', 'right', '_string')
+
     def __init__(self, left, right):
         """Form a half-closed bounded interval. If the right endpoint is 1,
         form a closed interval instead.
@@ -24,11 +35,17 @@ class Interval:
             raise Exception('invalid interval: empty set')
         self.left = left
         self.right = right
-        self.string = "[" + str(self.left) + ", " + str(self.right)
-        if self.right == 1:
-            self.string += "]"
-        else:
-            self.string += ")"
+        self._string = None
+
+    @property
+    def string(self):
+        if self._string is None:
+            self._string = "[" + str(self.left) + ", " + str(self.right)
+            if self.right == 1:
+                self._string += "]"
+            else:
+                self._string += ")"
+        return self._string
 
     def intersect(self, other):
         """Take the intersection of this interval and the given interval.
@@ -69,10 +86,16 @@ class Interval:
 
 
 class IntervalsSet:
-    """A collection of disjoint intervals in sorted order representing a set.
+    """A collection of disjoint intervals in sorted order representing a set. The endpoints
+    are stored in two parallel sorted arrays so that set operations can be vectorized.
 
     Attributes:
-        data (:obj:`List` of :obj:`Interval`): the collection of intervals.
+        left (:obj:`numpy.ndarray`): The left endpoints of the intervals in increasing order.
+        right (:obj:`numpy.ndarray`): The right endpoints of the intervals in increasing order.
+        min_left (float): The smallest left endpoint.
+        max_right (float): The largest right endpoint.
+        data (:obj:`List` of :obj:`Interval`): the collection of intervals. Built from the
+            endpoint arrays on first access.
     """
 
     def __init__(self, intervals):
@@ -87,10 +110,41 @@ class IntervalsSet:
         """
         if len(intervals) == 0:
             raise Exception('invalid intervals: cannot be empty')
-        self.data = sorted(intervals, key=lambda interval: interval.left)
-        for i in range(1, len(self.data)):
-            if self.data[i - 1].right > self.data[i].left:
-                raise Exception('invalid intervals: must be disjoint')
+        intervals = sorted(intervals, key=lambda interval: interval.left)
+        self.left = np.array([itv.left for itv in intervals], dtype=float)
+        self.right = np.array([itv.right for itv in intervals], dtype=float)
+        if np.any(self.right[:-1] > self.left[1:]):
+            raise Exception('invalid intervals: must be disjoint')
+        self.min_left = self.left.item(0)
+        self.max_right = self.right.item(-1)
+        self._data = intervals
+
+    @classmethod
+    def from_arrays(cls, left, right):
+        """Form an intervals set directly from endpoint arrays without validation.
+
+        Args:
+            left (:obj:`numpy.ndarray`): Nonempty sorted array of left endpoints.
+            right (:obj:`numpy.ndarray`): Sorted array of right endpoints, such that the
+                intervals [left[i], right[i]) are nonempty and disjoint.
+
+        Returns:
+            :obj:`IntervalsSet`: The intervals set with the given endpoints.
+        """
+        intervals_set = cls.__new__(cls)
+        intervals_set.left = left
+        intervals_set.right = right
+        intervals_set.min_left = left.item(0)
+        intervals_set.max_right = right.item(-1)
+        intervals_set._data = None
+        return intervals_set
+
+    @property
+    def data(self):
+        if self._data is None:
+            self._data = [Interval(_endpoint(left), _endpoint(right)) for left, right
+                          in zip(self.left.tolist(), self.right.tolist())]
+        return self._data
 
     def intersect(self, other):
         """Take the set intersection of the intervals set and the given intervals set.
@@ -102,24 +156,44 @@ class IntervalsSet:
             :obj:`IntervalsSet`: The intervals set representing the resulting set of the intersection.
             `None` if the intersection is an empty set.
         """
-        result = []
-        curr1 = curr2 = 0
-        length1 = len(self.data)
-        length2 = len(other.data)
-        while curr1 < length1 and curr2 < length2:
-            itv1 = self.data[curr1]
-            itv2 = other.data[curr2]
-            intersection = itv1.intersect(itv2)
-            if intersection != None:
-                result.append(intersection)
-            if itv1.right < itv2.right:
-                curr1 += 1
-            else:
-                curr2 += 1
-        if len(result) == 0:
+        if self.max_right <= other.min_left or other.max_right <= self.min_left:
             return None
-        else:
-            return IntervalsSet(result)
+        if len(self.left) == 1 and len(other.left) == 1:
+            left = max(self.min_left, other.min_left)
+            right = min(self.max_right, other.max_right)
+            return IntervalsSet.from_arrays(np.array([left]), np.array([right]))
+        # For each interval of this set, the intervals of the other set overlapping it form
+        # the contiguous range [lo, hi) in the other set's order.
+        lo = np.searchsorted(other.right, self.left, side='right')
+        hi = np.searchsorted(other.left, self.right, side='left')
+        counts = hi - lo
+        total = int(counts.sum())
+        if total == 0:
+            return None
+        mine = np.repeat(np.arange(len(counts)), counts)
+        starts = np.cumsum(counts) - counts
+        theirs = np.arange(total) - np.repeat(starts - lo, counts)
+        left = np.maximum(self.left[mine], other.left[theirs])
+        right = np.minimum(self.right[mine], other.right[theirs])
+        return IntervalsSet.from_arrays(left, right)
+
+    def overlaps(self, other):
+        """Check if the intervals set and the given intervals set have a nonempty intersection,
+        without forming the intersection.
+
+        Args:
+            other (:obj:`IntervalsSet`): The other intervals set.
+
+        Returns:
+            bool: True if the intersection of the two sets is nonempty, False otherwise.
+        """
+        if self.max_right <= other.min_left or other.max_right <= self.min_left:
+            return False
+        if len(self.left) == 1 and len(other.left) == 1:
+            return True
+        lo = np.searchsorted(other.right, self.left, side='right')
+        hi = np.searchsorted(other.left, self.right, side='left')
+        return bool(np.any(hi > lo))
 
     def contains(self, x):
         """Check if the given value is contained in the set.
@@ -130,10 +204,11 @@ class IntervalsSet:
         Returns:
             bool: True if the set contains the given value, False otherwise.
         """
-        for itv in self.data:
-            if itv.contains(x):
-                return True
-        return False
+        i = int(np.searchsorted(self.left, x, side='right')) - 1
+        if i < 0:
+            return False
+        right = self.right[i]
+        return x < right or (right == 1 and x == right)
 
     def __str__(self):
         s = str(self.data[0])
@@ -161,16 +236,15 @@ class SemiPartition:
         """
         if len(sets) == 0:
             raise Exception('invalid sets: cannot be empty')
-        all_intervals = []
-        for itvs in sets:
-            for itv in itvs.data:
-                all_intervals.append(itv)
-        all_intervals.sort(key=lambda interval: interval.left)
-        if all_intervals[0].left < 0 or all_intervals[len(all_intervals) - 1].right > 1:
+        left = np.concatenate([itvs.left for itvs in sets])
+        right = np.concatenate([itvs.right for itvs in sets])
+        order = np.argsort(left, kind='stable')
+        left = left[order]
+        right = right[order]
+        if left[0] < 0 or right[-1] > 1:
             raise Exception('invalid sets: exceeds [0, 1]')
-        for i in range(len(all_intervals) - 1):
-            if all_intervals[i].right > all_intervals[i + 1].left:
-                raise Exception('invalid sets: sets not disjoint')
+        if np.any(right[:-1] > left[1:]):
+            raise Exception('invalid sets: sets not disjoint')
         self.sets = sets[:]
 
     def __str__(self):
@@ -183,7 +257,8 @@ class SemiPartition:
 
 class Cluster:
     """A collection of sets implemented with a DoublyLinkedList. The sets consist of one
-    or more disjoint intervals.
+    or more disjoint intervals. Sets are removed through the semi-clustering of the
+    cluster, which maps each set to its node of the list.
 
     Attributes:
         sets (:obj:`DoublyLinkedList` of :obj:`IntervalsSet`): The collection of sets.
@@ -203,35 +278,6 @@ class Cluster:
     def is_empty(self):
         return self.sets.is_empty()
 
-    def remove(self, x):
-        """Remove the set that contains the given value, if any.
-
-        Args:
-            x (float): A given value.
-
-        Returns:
-            :obj:`IntervalsSet`: The set removed. `None` if no set is removed.
-
-        Raises:
-            Exception: If the cluster would become empty after removal.
-        """
-        curr = self.sets.first
-        while curr != None:
-            if curr.data.contains(x):
-                if curr.prev == None and curr.next == None:
-                    raise Exception()
-                if curr.prev == None:
-                    self.sets.first = curr.next
-                else:
-                    curr.prev.next = curr.next
-                if curr.next == None:
-                    self.sets.last = curr.prev
-                else:
-                    curr.next.prev = curr.prev
-                return curr.data
-            curr = curr.next
-        return None
-
     def __str__(self):              # assume self is nonempty
         curr = self.sets.first
         result = str(curr.data)
@@ -243,11 +289,418 @@ class Cluster:
 
 
 class SemiClustering:
+    """A collection of clusters whose sets are pairwise disjoint.
+
+    The clusters are backed by a disjoint-set forest over their sets, so that fusing two
+    clusters and finding the cluster of a set take near-constant time. Each cluster has a
+    key, increasing along the list of clusters, so that the position of a cluster is found
+    by bisection. Each set is also
+    mapped to its node in the list of its cluster, so that removing a set takes constant
+    time: the set is unlinked from the list and left in the forest, which is rebuilt once
+    the sets removed outnumber the others. The intervals of all sets are additionally
+    indexed by their left endpoints for point, containment and overlap lookups. The
+    clusters should therefore be modified through the methods of the semi-clustering.
+
+    Attributes:
+        clusters (:obj:`list` of :obj:`Cluster`): The clusters of the semi-clustering.
+        journal (:obj:`Journal`): The journal recording how to undo the modifications of
+            the semi-clustering. `None` if the modifications are not recorded.
+    """
 
     def __init__(self, clusters):
         if len(clusters) == 0:
             raise Exception('invalid clusters: cannot be empty')
-        self.clusters = clusters[:]
+        self.clusters = []
+        self._parent = {}
+        self._size = {}
+        self._cluster_of_root = {}
+        self._nodes = {}
+        self._removed = 0
+        self._order = {}
+        self._keys = []
+        self._next_order = 0
+        self._lefts = []
+        self._rights = []
+        self._owners = []
+        self.journal = None
+        for cluster in clusters:
+            self.add_cluster(cluster)
+
+    @classmethod
+    def from_index(cls, clusters, lefts, rights, owners):
+        """Form a semi-clustering from its clusters and the index of their intervals
+        without validation.
+
+        Args:
+            clusters (:obj:`list` of :obj:`Cluster`): Nonempty list of clusters whose sets
+                are pairwise disjoint.
+            lefts (:obj:`list` of float): The left endpoints of the intervals of all sets in
+                increasing order.
+            rights (:obj:`list` of float): The right endpoints of the same intervals.
+            owners (:obj:`list` of :obj:`IntervalsSet`): The set of each interval.
+
+        Returns:
+            :obj:`SemiClustering`: The semi-clustering.
+        """
+        semi_clustering = cls.__new__(cls)
+        semi_clustering.clusters = list(clusters)
+        semi_clustering._parent = {}
+        semi_clustering._size = {}
+        semi_clustering._cluster_of_root = {}
+        semi_clustering._nodes = {}
+        semi_clustering._removed = 0
+        semi_clustering._order = {cluster: key for key, cluster
+                                  in enumerate(semi_clustering.clusters)}
+        semi_clustering._keys = list(range(len(semi_clustering.clusters)))
+        semi_clustering._next_order = len(semi_clustering.clusters)
+        semi_clustering._lefts = lefts
+        semi_clustering._rights = rights
+        semi_clustering._owners = owners
+        semi_clustering.journal = None
+        for cluster in semi_clustering.clusters:
+            semi_clustering._make_component(cluster)
+        return semi_clustering
+
+    def _find(self, intervals_set):
+        parent = self._parent
+        root = intervals_set
+        while parent[root] is not root:
+            root = parent[root]
+        if self.journal != None:    # keep the forest intact for the undo records
+            return root
+        while parent[intervals_set] is not root:
+            parent[intervals_set], intervals_set = root, parent[intervals_set]
+        return root
+
+    def _make_component(self, cluster):
+        root = cluster.sets.first.data
+        size = 0
+        node = cluster.sets.first
+        while node != None:
+            self._parent[node.data] = root
+            self._nodes[node.data] = node
+            size += 1
+            node = node.next
+        self._size[root] = size
+        self._cluster_of_root[root] = cluster
+
+    def _discard_component(self, cluster):
+        root = self._find(cluster.sets.first.data)
+        del self._cluster_of_root[root]
+        del self._size[root]
+
+    def _rebuild_forest(self):
+        self._parent = {}
+        self._size = {}
+        self._cluster_of_root = {}
+        for cluster in self.clusters:
+            self._make_component(cluster)
+        self._removed = 0
+
+    def _index_set(self, intervals_set):
+        for left, right in zip(intervals_set.left.tolist(), intervals_set.right.tolist()):
+            i = bisect.bisect_left(self._lefts, left)
+            self._lefts.insert(i, left)
+            self._rights.insert(i, right)
+            self._owners.insert(i, intervals_set)
+
+    def _unindex_set(self, intervals_set):
+        for left in intervals_set.left.tolist():
+            i = bisect.bisect_left(self._lefts, left)
+            del self._lefts[i]
+            del self._rights[i]
+            del self._owners[i]
+
+    def _position(self, cluster):
+        # the clusters are always in the order of their keys
+        return bisect.bisect_left(self._keys, self._order[cluster])
+
+    def _append_cluster(self, cluster):
+        self.clusters.append(cluster)
+        self._keys.append(self._next_order)
+        self._order[cluster] = self._next_order
+        self._next_order += 1
+
+    def _insert_cluster(self, index, cluster, order):
+        self.clusters.insert(index, cluster)
+        self._keys.insert(index, order)
+        self._order[cluster] = order
+
+    def _remove_cluster(self, index):
+        del self._order[self.clusters[index]]
+        del self.clusters[index]
+        del self._keys[index]
+
+    def add_cluster(self, cluster):
+        """Append the given cluster to the semi-clustering.
+
+        Args:
+            cluster (:obj:`Cluster`): A cluster whose sets are disjoint from the sets of
+                the semi-clustering.
+        """
+        if self.journal != None:
+            self.journal.record(self._undo_add_cluster, cluster, self._next_order)
+        self._append_cluster(cluster)
+        self._make_component(cluster)
+        for intervals_set in cluster.sets:
+            self._index_set(intervals_set)
+
+    def _undo_add_cluster(self, cluster, next_order):
+        self._discard_component(cluster)
+        for intervals_set in cluster.sets:
+            del self._parent[intervals_set]
+            del self._nodes[intervals_set]
+            self._unindex_set(intervals_set)
+        self._remove_cluster(self._position(cluster))
+        self._next_order = next_order
+
+    def remove_set(self, intervals_set):
+        """Remove the given set from its cluster. The cluster is removed from the
+        semi-clustering if it becomes empty.
+
+        Args:
+            intervals_set (:obj:`IntervalsSet`): A set of the semi-clustering.
+        """
+        cluster = self.cluster_of(intervals_set)
+        node = self._nodes.pop(intervals_set)
+        root = self._find(intervals_set)
+        self._unindex_set(intervals_set)
+        cluster.sets.unlink(node)
+        self._removed += 1
+        if cluster.is_empty():
+            index = self._position(cluster)
+            if self.journal != None:
+                self.journal.record(self._undo_remove_set, node, cluster, index,
+                                    self._order[cluster])
+            del self._cluster_of_root[root]
+            del self._size[root]
+            self._remove_cluster(index)
+        else:
+            if self.journal != None:
+                self.journal.record(self._undo_remove_set, node, cluster, None, None)
+            self._size[root] -= 1
+        if self._removed > len(self._nodes):
+            self._rebuild_forest()
+
+    def _undo_remove_set(self, node, cluster, index, order):
+        intervals_set = node.data
+        if intervals_set in self._parent:
+            self._removed -= 1
+        if cluster.is_empty():
+            cluster.sets.relink(node)
+            self._insert_cluster(index, cluster, order)
+            self._make_component(cluster)
+        else:
+            root = self._find(cluster.sets.first.data)
+            cluster.sets.relink(node)
+            self._parent[intervals_set] = root
+            self._size[root] += 1
+            self._nodes[intervals_set] = node
+        self._index_set(intervals_set)
+
+    def fuse(self, a, b):
+        """Move the sets of the b-th cluster to the back of the a-th cluster and remove the
+        b-th cluster.
+
+        Args:
+            a (int): The index of the cluster to be kept.
+            b (int): The index of the cluster to be merged into the a-th cluster.
+
+        Returns:
+            :obj:`Cluster`: The resulting cluster.
+        """
+        cluster = self.clusters[a]
+        other = self.clusters[b]
+        root = self._find(cluster.sets.first.data)
+        other_root = self._find(other.sets.first.data)
+        if self.journal != None:
+            self.journal.record(self._undo_fuse, cluster, other, other.sets.first, b,
+                                self._order[other])
+        del self._cluster_of_root[root]
+        del self._cluster_of_root[other_root]
+        if self._size[root] < self._size[other_root]:
+            root, other_root = other_root, root
+        self._parent[other_root] = root
+        self._size[root] += self._size.pop(other_root)
+        self._cluster_of_root[root] = cluster
+        cluster.sets.extend(other.sets)
+        self._remove_cluster(b)
+        return cluster
+
+    def _undo_fuse(self, cluster, other, first, index, order):
+        self._discard_component(cluster)
+        other.sets = cluster.sets.split(first)
+        self._insert_cluster(index, other, order)
+        self._make_component(cluster)
+        self._make_component(other)
+
+    def split(self, a):
+        """Replace the a-th cluster with one cluster per set, appended to the back of the
+        semi-clustering.
+
+        Args:
+            a (int): The index of the cluster.
+
+        Returns:
+            :obj:`Cluster`: The cluster removed. Its sets are left untouched.
+        """
+        cluster = self.clusters[a]
+        if self.journal != None:
+            self.journal.record(self._undo_split, cluster, a, self._order[cluster],
+                                self._next_order)
+        self._discard_component(cluster)
+        for intervals_set in cluster.sets:
+            new_cluster = Cluster([intervals_set])
+            self._append_cluster(new_cluster)
+            self._make_component(new_cluster)
+        self._remove_cluster(a)
+        return cluster
+
+    def _undo_split(self, cluster, index, order, next_order):
+        for _ in cluster.sets:
+            new_cluster = self.clusters[-1]
+            self._discard_component(new_cluster)
+            self._remove_cluster(len(self.clusters) - 1)
+        self._insert_cluster(index, cluster, order)
+        self._next_order = next_order
+        self._make_component(cluster)
+
+    def cluster_of(self, intervals_set):
+        """Find the cluster which the given set is in.
+
+        Args:
+            intervals_set (:obj:`IntervalsSet`): The given set.
+
+        Returns:
+            :obj:`Cluster`: The cluster. `None` if the set is not in the semi-clustering.
+        """
+        if intervals_set not in self._nodes:
+            return None
+        return self._cluster_of_root[self._find(intervals_set)]
+
+    def order(self, cluster):
+        """A key that sorts the clusters in the same order as the list of clusters.
+
+        Args:
+            cluster (:obj:`Cluster`): A cluster of the semi-clustering.
+
+        Returns:
+            int: The key of the cluster.
+        """
+        return self._order[cluster]
+
+    def cluster_index(self, intervals_set):
+        """Find the index of the cluster which the given set is in.
+
+        Args:
+            intervals_set (:obj:`IntervalsSet`): The given set.
+
+        Returns:
+            int: The index of the cluster. `None` if the set is not in the semi-clustering.
+        """
+        cluster = self.cluster_of(intervals_set)
+        if cluster is None:
+            return None
+        return self._position(cluster)
+
+    def clusters_overlapping(self, intervals_set):
+        """Find the clusters with a set overlapping the given set.
+
+        Args:
+            intervals_set (:obj:`IntervalsSet`): The given set.
+
+        Returns:
+            :obj:`list` of :obj:`Cluster`: The clusters, in the order of the list of clusters.
+        """
+        found = {}
+        for left, right in zip(intervals_set.left.tolist(), intervals_set.right.tolist()):
+            lo = bisect.bisect_right(self._rights, left)
+            hi = bisect.bisect_left(self._lefts, right, lo)
+            for i in range(lo, hi):
+                cluster = self.cluster_of(self._owners[i])
+                found[self._order[cluster]] = cluster
+        return [found[key] for key in sorted(found)]
+
+    def copy(self):
+        """Copy the semi-clustering. The sets are shared with the copy, everything else
+        is copied. Modifications of the copy are not recorded.
+
+        Returns:
+            :obj:`SemiClustering`: The copy.
+        """
+        other = SemiClustering.__new__(SemiClustering)
+        copies = {}
+        for cluster in self.clusters:
+            copies[cluster] = Cluster(list(cluster.sets))
+        other.clusters = [copies[cluster] for cluster in self.clusters]
+        other._parent = dict(self._parent)
+        other._size = dict(self._size)
+        other._cluster_of_root = {root: copies[cluster]
+                                  for root, cluster in self._cluster_of_root.items()}
+        other._nodes = {}
+        for cluster in other.clusters:
+            node = cluster.sets.first
+            while node != None:
+                other._nodes[node.data] = node
+                node = node.next
+        other._removed = self._removed
+        other._order = {copies[cluster]: key for cluster, key in self._order.items()}
+        other._keys = self._keys[:]
+        other._next_order = self._next_order
+        other._lefts = self._lefts[:]
+        other._rights = self._rights[:]
+        other._owners = self._owners[:]
+        other.journal = None
+        return other
+
+    def find_set(self, x):
+        """Find the set that contains the given value.
+
+        Args:
+            x (float): A given value.
+
+        Returns:
+            :obj:`IntervalsSet`: The set containing x. `None` if no set contains x.
+        """
+        i = bisect.bisect_right(self._lefts, x) - 1
+        if i < 0:
+            return None
+        right = self._rights[i]
+        if x < right or (right == 1 and x == right):
+            return self._owners[i]
+        return None
+
+    def intersections(self, interval):
+        """Intersect the given interval with the intervals of the sets. Only the intervals
+        overlapping the given interval are visited.
+
+        Args:
+            interval (:obj:`Interval`): The given interval.
+
+        Returns:
+            :obj:`list` of :obj:`Interval`: The nonempty intersections in sorted order.
+        """
+        lo = bisect.bisect_right(self._rights, interval.left)
+        hi = bisect.bisect_left(self._lefts, interval.right, lo)
+        result = []
+        for i in range(lo, hi):
+            result.append(Interval(max(_endpoint(self._lefts[i]), interval.left),
+                                   min(_endpoint(self._rights[i]), interval.right)))
+        return result
+
+    def find_cluster_including(self, itv):
+        """Find the cluster with an interval that includes the given interval.
+
+        Args:
+            itv (:obj:`Interval`): The given interval.
+
+        Returns:
+            int: The index of the cluster. `None` if no cluster includes the given interval.
+        """
+        i = bisect.bisect_right(self._lefts, itv.left) - 1
+        if i < 0 or itv.right > self._rights[i]:
+            return None
+        return self.cluster_index(self._owners[i])
 
     def __str__(self):
         result = "{" + str(self.clusters[0])
@@ -268,18 +721,509 @@ class TreeNode:
 
 
 class Tree:
+    """A tree of TreeNode objects.
+
+    Besides the nodes themselves, the tree exposes the node operations used by KServer,
+    which are shared with FlatTree: nodes are handles passed to the methods of the tree,
+    and the data of a node is a sequence of (content, origin) tuples.
+
+    Attributes:
+        root (:obj:`TreeNode`): The root of the tree.
+        journal (:obj:`Journal`): The journal recording how to undo the modifications of
+            the tree. `None` if the modifications are not recorded.
+    """
 
     def __init__(self, root):
         self.root = root
+        self.journal = None
+
+    @classmethod
+    def with_root(cls, data):
+        """Form a tree consisting of a root with the given data.
+
+        Args:
+            data (:obj:`list`): The data of the root.
+
+        Returns:
+            :obj:`Tree`: The tree.
+        """
+        return cls(TreeNode(DoublyLinkedList(data)))
+
+    @classmethod
+    def from_arrays(cls, nodes, level_sets):
+        """Form a tree from nodes packed into flat arrays.
+
+        Args:
+            nodes (:obj:`tuple` of :obj:`numpy.ndarray`): The nodes in pre-order, packed as
+                by kserver._serialize_nodes with the parent of the root set to -1.
+            level_sets (:obj:`list` of :obj:`list`): The sets of each level which the
+                origins of the entries are positions in.
+
+        Returns:
+            :obj:`Tree`: The tree. The contents are views of the given endpoint arrays.
+        """
+        parents, levels, entry_counts, origins, interval_counts, lefts, rights = nodes
+        origins = origins.tolist()
+        ends = np.cumsum(interval_counts).tolist()
+        handles = []
+        entry = 0
+        start = 0
+        for parent, level, count in zip(parents.tolist(), levels.tolist(),
+                                        entry_counts.tolist()):
+            sets = level_sets[level]
+            data = []
+            for k in range(entry, entry + count):
+                end = ends[k]
+                data.append((IntervalsSet.from_arrays(lefts[start:end], rights[start:end]),
+                             sets[origins[k]]))
+                start = end
+            entry += count
+            node = TreeNode(DoublyLinkedList(data))
+            if parent != -1:
+                handles[parent].children.append(node)
+            handles.append(node)
+        return cls(handles[0])
+
+    def children(self, node):
+        """The children of the given node. The returned list must not be modified."""
+        return node.children
+
+    def set_children(self, node, children):
+        """Replace the children of the given node with the given list of nodes."""
+        if self.journal != None:
+            self.journal.record(setattr, node, 'children', node.children)
+        node.children = children
+
+    def add_child(self, node, data):
+        """Append a new child with the given list of data to the given node.
+
+        Returns:
+            :obj:`TreeNode`: The new child.
+        """
+        if self.journal != None:
+            self.journal.record(node.children.pop)
+        node.add_child(DoublyLinkedList(data))
+        return node.children[len(node.children) - 1]
+
+    def data(self, node):
+        """The data of the given node as an iterable of (content, origin) tuples."""
+        return node.data
+
+    def first(self, node):
+        """The first (content, origin) tuple of the data of the given node."""
+        return node.data.first.data
+
+    def set_data(self, node, data):
+        """Replace the data of the given node with the given list of data."""
+        if self.journal != None:
+            self.journal.record(setattr, node, 'data', node.data)
+        node.data = DoublyLinkedList(data)
+
+    def merge(self, node, other):
+        """Move the data and the children of the node other to the back of those of the
+        given node.
+        """
+        if self.journal != None:
+            self.journal.record(self._undo_merge, node, other, other.data.first,
+                                node.children)
+        node.data.extend(other.data)
+        node.children = node.children + other.children
+
+    def _undo_merge(self, node, other, first, children):
+        other.data = node.data.split(first)
+        node.children = children
+
+    def reclaim(self):
+        """Nothing to reclaim: the nodes detached from the tree are garbage collected."""
+
+    def copy(self):
+        """Copy the structure of the tree. The (content, origin) tuples are shared with the
+        copy.
+
+        Returns:
+            :obj:`Tree`: The copy.
+        """
+        other = Tree(TreeNode(DoublyLinkedList(list(self.root.data))))
+        stack = [(self.root, other.root)]
+        while len(stack) > 0:
+            node, copied = stack.pop()
+            for child in node.children:
+                copied.add_child(DoublyLinkedList(list(child.data)))
+                stack.append((child, copied.children[len(copied.children) - 1]))
+        return other
 
     def print_tree(self):
         self._print_tree(self.root, 0)
 
     def _print_tree(self, node, level):
-        print(str("    " * level) + str(node.data))
-        for child in node.children:
-            self._print_tree(child, level + 1)
+        stack = [(node, level)]
+        while len(stack) > 0:
+            node, level = stack.pop()
+            print(str("    " * level) + str(node.data))
+            for child in reversed(node.children):
+                stack.append((child, level + 1))
+
+
+class FlatTree:
+    """A tree stored in struct-of-arrays form with the node operations of Tree.
+
+    Nodes are integer indices into compact arrays holding the parent, the first and last
+    child, the next sibling, the level and the head and tail of the data list of each node.
+    The data of a node is a linked list of entries, each holding the range of its content
+    in a shared buffer of interval endpoints and the index of its origin in a table of
+    origin sets. Merging nodes links these lists without copying. Nodes and entries that
+    are detached from the tree, and the entries replaced by set_data, stay in the arrays
+    until reclaim compacts them, which renumbers the nodes.
+
+    Attributes:
+        root (int): The root of the tree.
+        journal (:obj:`Journal`): The journal recording how to undo the modifications of
+            the tree. `None` if the modifications are not recorded.
+    """
+
+    columns = ('parent', 'first_child', 'last_child', 'next_sibling', 'level', 'data_head',
+               'data_tail', 'entry_next', 'entry_origin', 'entry_start', 'entry_count',
+               'left', 'right')
+
+    def __init__(self, data):
+        """Form a tree consisting of a root with the given data.
+
+        Args:
+            data (:obj:`list`): The data of the root, as (content, origin) tuples.
+        """
+        self.parent = array.array('i')
+        self.first_child = array.array('i')
+        self.last_child = array.array('i')
+        self.next_sibling = array.array('i')
+        self.level = array.array('i')
+        self.data_head = array.array('i')
+        self.data_tail = array.array('i')
+        self.entry_next = array.array('i')
+        self.entry_origin = array.array('i')
+        self.entry_start = array.array('i')
+        self.entry_count = array.array('i')
+        self.left = array.array('d')
+        self.right = array.array('d')
+        self.origins = []
+        self._origin_ids = {}
+        self.journal = None
+        self.root = self._new_node(-1, 0)
+        self.set_data(self.root, data)
+        self._reclaimed = (1, len(self.left))
+
+    @classmethod
+    def with_root(cls, data):
+        return cls(data)
+
+    @classmethod
+    def from_arrays(cls, nodes, level_sets):
+        """Form a tree from nodes packed into flat arrays. The columns are computed with
+        array operations rather than node by node.
+
+        Args:
+            nodes (:obj:`tuple` of :obj:`numpy.ndarray`): The nodes in pre-order, packed as
+                by kserver._serialize_nodes with the parent of the root set to -1.
+            level_sets (:obj:`list` of :obj:`list`): The sets of each level which the
+                origins of the entries are positions in.
+
+        Returns:
+            :obj:`FlatTree`: The tree.
+        """
+        parents, levels, entry_counts, origins, interval_counts, lefts, rights = nodes
+        count = len(parents)
+        first_child = np.full(count, -1)
+        last_child = np.full(count, -1)
+        next_sibling = np.full(count, -1)
+        if count > 1:
+            # in pre-order the children of a node appear in order after the node
+            order = np.argsort(parents[1:], kind='stable')
+            children = order + 1
+            owners = parents[1:][order]
+            is_first = np.concatenate(([True], owners[1:] != owners[:-1]))
+            is_last = np.concatenate((owners[1:] != owners[:-1], [True]))
+            first_child[owners[is_first]] = children[is_first]
+            last_child[owners[is_last]] = children[is_last]
+            has_next = ~is_last[:-1]
+            next_sibling[children[:-1][has_next]] = children[1:][has_next]
+        entry_ends = np.cumsum(entry_counts)
+        has_data = entry_counts > 0
+        entry_next = np.arange(1, len(origins) + 1)
+        entry_next[entry_ends[has_data] - 1] = -1
+        offsets = np.cumsum([0] + [len(sets) for sets in level_sets])
+        interval_ends = np.cumsum(interval_counts)
+
+        tree = cls.__new__(cls)
+        columns = {
+            'parent': parents, 'first_child': first_child, 'last_child': last_child,
+            'next_sibling': next_sibling, 'level': levels,
+            'data_head': np.where(has_data, entry_ends - entry_counts, -1),
+            'data_tail': np.where(has_data, entry_ends - 1, -1),
+            'entry_next': entry_next,
+            'entry_origin': offsets[np.repeat(levels, entry_counts)] + origins,
+            'entry_start': interval_ends - interval_counts, 'entry_count': interval_counts,
+            'left': lefts, 'right': rights}
+        for name in FlatTree.columns:
+            typecode = 'd' if name in ('left', 'right') else 'i'
+            column = array.array(typecode)
+            column.frombytes(np.ascontiguousarray(columns[name], dtype=typecode).tobytes())
+            setattr(tree, name, column)
+        tree.origins = [s for sets in level_sets for s in sets]
+        tree._origin_ids = {s: k for k, s in enumerate(tree.origins)}
+        tree.journal = None
+        tree.root = 0
+        tree._reclaimed = (count, len(lefts))
+        return tree
+
+    def copy(self):
+        """Copy the tree. The origin sets are shared with the copy. Modifications of the
+        copy are not recorded.
+
+        Returns:
+            :obj:`FlatTree`: The copy.
+        """
+        other = FlatTree.__new__(FlatTree)
+        for name in FlatTree.columns:
+            column = getattr(self, name)
+            setattr(other, name, array.array(column.typecode, column))
+        other.origins = self.origins[:]
+        other._origin_ids = dict(self._origin_ids)
+        other.root = self.root
+        other.journal = None
+        other._reclaimed = self._reclaimed
+        return other
+
+    def reclaim(self):
+        """Compact the arrays to the nodes and entries of the tree once the arrays have
+        doubled since the last compaction, so that detached nodes and replaced entries
+        take amortized constant time to reclaim. The nodes are renumbered in pre-order, so
+        node handles must not be kept across calls. Nothing is reclaimed while the
+        modifications are recorded, as the records refer to the current numbering.
+        """
+        nodes, endpoints = self._reclaimed
+        if self.journal != None or (len(self.parent) <= 2 * nodes and
+                                    len(self.left) <= 2 * max(endpoints, 1)):
+            return
+        order = []
+        stack = [self.root]
+        while len(stack) > 0:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(reversed(self.children(node)))
+        entries = []
+        for node in order:
+            entry = self.data_head[node]
+            while entry != -1:
+                entries.append(entry)
+                entry = self.entry_next[entry]
+
+        order = np.array(order, dtype=int)
+        entries = np.array(entries, dtype=int)
+        # the new index of each old node and entry, with -1 mapped to itself
+        node_ids = np.full(len(self.parent) + 1, -1)
+        node_ids[order] = np.arange(len(order))
+        entry_ids = np.full(len(self.entry_next) + 1, -1)
+        entry_ids[entries] = np.arange(len(entries))
+
+        def column(name, kept):
+            return np.frombuffer(getattr(self, name), dtype=np.intc)[kept]
+
+        counts = column('entry_count', entries)
+        new_starts = np.cumsum(counts) - counts
+        positions = np.repeat(column('entry_start', entries) - new_starts, counts) + \
+            np.arange(counts.sum())
+        origins, entry_origin = np.unique(column('entry_origin', entries),
+                                          return_inverse=True)
+        columns = {
+            'parent': node_ids[column('parent', order)],
+            'first_child': node_ids[column('first_child', order)],
+            'last_child': node_ids[column('last_child', order)],
+            'next_sibling': node_ids[column('next_sibling', order)],
+            'level': column('level', order),
+            'data_head': entry_ids[column('data_head', order)],
+            'data_tail': entry_ids[column('data_tail', order)],
+            'entry_next': entry_ids[column('entry_next', entries)],
+            'entry_origin': entry_origin, 'entry_start': new_starts, 'entry_count': counts,
+            'left': np.frombuffer(self.left, dtype=float)[positions],
+            'right': np.frombuffer(self.right, dtype=float)[positions]}
+        for name in FlatTree.columns:
+            typecode = 'd' if name in ('left', 'right') else 'i'
+            values = array.array(typecode)
+            values.frombytes(np.ascontiguousarray(columns[name], dtype=typecode).tobytes())
+            setattr(self, name, values)
+        self.origins = [self.origins[k] for k in origins.tolist()]
+        self._origin_ids = {origin: k for k, origin in enumerate(self.origins)}
+        self.root = 0
+        self._reclaimed = (len(self.parent), len(self.left))
+
+    def _set(self, column, index, value):
+        if self.journal != None:
+            self.journal.record(column.__setitem__, index, column[index])
+        column[index] = value
+
+    def _new_node(self, parent, level):
+        if self.journal != None:
+            self.journal.record(self._pop_node)
+        node = len(self.parent)
+        self.parent.append(parent)
+        self.first_child.append(-1)
+        self.last_child.append(-1)
+        self.next_sibling.append(-1)
+        self.level.append(level)
+        self.data_head.append(-1)
+        self.data_tail.append(-1)
+        return node
+
+    def _pop_node(self):
+        for column in (self.parent, self.first_child, self.last_child, self.next_sibling,
+                       self.level, self.data_head, self.data_tail):
+            column.pop()
+
+    def _new_entry(self, content, origin):
+        origin_id = self._origin_ids.get(origin)
+        if self.journal != None:
+            self.journal.record(self._pop_entry, origin_id is None)
+        if origin_id is None:
+            origin_id = len(self.origins)
+            self.origins.append(origin)
+            self._origin_ids[origin] = origin_id
+        entry = len(self.entry_next)
+        self.entry_next.append(-1)
+        self.entry_origin.append(origin_id)
+        self.entry_start.append(len(self.left))
+        self.entry_count.append(len(content.left))
+        self.left.extend(content.left.tolist())
+        self.right.extend(content.right.tolist())
+        return entry
+
+    def _pop_entry(self, new_origin):
+        start = self.entry_start.pop()
+        del self.left[start:]
+        del self.right[start:]
+        self.entry_next.pop()
+        self.entry_origin.pop()
+        self.entry_count.pop()
+        if new_origin:
+            del self._origin_ids[self.origins.pop()]
+
+    def _entry(self, entry):
+        start = self.entry_start[entry]
+        end = start + self.entry_count[entry]
+        content = IntervalsSet.from_arrays(np.array(self.left[start:end]),
+                                           np.array(self.right[start:end]))
+        return (content, self.origins[self.entry_origin[entry]])
+
+    def __len__(self):
+        """The number of nodes allocated, including detached ones."""
+        return len(self.parent)
+
+    def children(self, node):
+        result = []
+        child = self.first_child[node]
+        while child != -1:
+            result.append(child)
+            child = self.next_sibling[child]
+        return result
+
+    def set_children(self, node, children):
+        prev = -1
+        for child in children:
+            self._set(self.parent, child, node)
+            if prev == -1:
+                self._set(self.first_child, node, child)
+            else:
+                self._set(self.next_sibling, prev, child)
+            prev = child
+        if prev == -1:
+            self._set(self.first_child, node, -1)
+        else:
+            self._set(self.next_sibling, prev, -1)
+        self._set(self.last_child, node, prev)
+
+    def add_child(self, node, data):
+        child = self._new_node(node, self.level[node] + 1)
+        if self.last_child[node] == -1:
+            self._set(self.first_child, node, child)
+        else:
+            self._set(self.next_sibling, self.last_child[node], child)
+        self._set(self.last_child, node, child)
+        self.set_data(child, data)
+        return child
 
+    def data(self, node):
+        result = []
+        entry = self.data_head[node]
+        while entry != -1:
+            result.append(self._entry(entry))
+            entry = self.entry_next[entry]
+        return result
+
+    def first(self, node):
+        return self._entry(self.data_head[node])
+
+    def set_data(self, node, data):
+        head = tail = -1
+        for content, origin in data:
+            entry = self._new_entry(content, origin)
+            if head == -1:
+                head = entry
+            else:
+                self._set(self.entry_next, tail, entry)
+            tail = entry
+        self._set(self.data_head, node, head)
+        self._set(self.data_tail, node, tail)
+
+    def merge(self, node, other):
+        if self.data_head[node] == -1:
+            self._set(self.data_head, node, self.data_head[other])
+        elif self.data_head[other] != -1:
+            self._set(self.entry_next, self.data_tail[node], self.data_head[other])
+        if self.data_head[other] != -1:
+            self._set(self.data_tail, node, self.data_tail[other])
+        self._set(self.data_head, other, -1)
+        self._set(self.data_tail, other, -1)
+        self.set_children(node, self.children(node) + self.children(other))
+        self._set(self.first_child, other, -1)
+        self._set(self.last_child, other, -1)
+
+
+class Journal:
+    """A log of modifications, each recorded as a function call that undoes it. The data
+    structures given a journal record their modifications into it, so that the state at
+    any mark can be restored in time proportional to the modifications made since.
+
+    Attributes:
+        entries (:obj:`list` of :obj:`tuple`): The (function, arguments) pairs recorded.
+    """
+
+    def __init__(self):
+        self.entries = []
+
+    def record(self, undo, *args):
+        """Record a modification.
+
+        Args:
+            undo (:obj:`callable`): The function undoing the modification.
+            *args: The arguments of the function.
+        """
+        self.entries.append((undo, args))
+
+    def mark(self):
+        """Mark the current state.
+
+        Returns:
+            int: The mark.
+        """
+        return len(self.entries)
+
+    def rollback(self, mark):
+        """Undo the modifications recorded after the given mark, latest first.
+
+        Args:
+            mark (int): A mark returned by the journal.
+        """
+        while len(self.entries) > mark:
+            undo, args = self.entries.pop()
+            undo(*args)
 
 
 class DoublyListNode:
@@ -305,9 +1249,15 @@ class DoublyLinkedList:
             data_list (:obj:`List`): The list of data used to form the doubly linked list.
         """
         self.first = None
-        self.last = None
+        prev = None
         for data in data_list:
-            self.push_back(data)
+            node = DoublyListNode(data, prev, None)
+            if prev == None:
+                self.first = node
+            else:
+                prev.next = node
+            prev = node
+        self.last = prev
 
     def is_empty(self):
         """Check if the doubly linked list is empty.
@@ -336,6 +1286,62 @@ class DoublyLinkedList:
             self.last.next = node
             self.last = node
 
+    def unlink(self, node):
+        """Remove the given node from the list. The node keeps its links to its former
+        neighbours, so that relink can put it back.
+
+        Args:
+            node (:obj:`DoublyListNode`): A node of the list.
+        """
+        if node.prev == None:
+            self.first = node.next
+        else:
+            node.prev.next = node.next
+        if node.next == None:
+            self.last = node.prev
+        else:
+            node.next.prev = node.prev
+
+    def relink(self, node):
+        """Put back a node removed by unlink. This is the inverse of unlink, provided the
+        list is in the state it was left in by the unlink.
+
+        Args:
+            node (:obj:`DoublyListNode`): The node removed.
+        """
+        if node.prev == None:
+            self.first = node
+        else:
+            node.prev.next = node
+        if node.next == None:
+            self.last = node
+        else:
+            node.next.prev = node
+
+    def split(self, node):
+        """Move the elements from the given node on to a new list. This is the inverse of
+        extend.
+
+        Args:
+            node (:obj:`DoublyListNode`): The node of the first element moved. `None` to
+                move nothing.
+
+        Returns:
+            :obj:`DoublyLinkedList`: The list of the elements moved.
+        """
+        other = DoublyLinkedList([])
+        if node == None:
+            return other
+        other.first = node
+        other.last = self.last
+        if node.prev == None:
+            self.set_to_empty()
+        else:
+            self.last = node.prev
+            node.prev.next = None
+            node.prev = None
+        return other
+
     def extend(self, other):
         """Move the elements in the given doubly linked list to the back of this list
         with original order preserved. The given list becomes empty after the operation.
@@ -414,19 +1420,10 @@ def interval_complement_semi_clustering(interval, semi_clustering):
     Returns:
         :obj:`IntervalsSet`: The resulting set of the operation. `None` if the resulting set is empty.
     """
-    intersections = []
-    for cluster in semi_clustering.clusters:
-        curr = cluster.sets.first
-        while curr != None:
-            for itv in curr.data.data:
-                intersection = interval.intersect(itv)
-                if intersection != None:
-                    intersections.append(intersection)
-            curr = curr.next
+    intersections = semi_clustering.intersections(interval)
     if len(intersections) == 0:
         complement = [interval]
     else:
-        intersections.sort(key=lambda itv: itv.left)
         complement = []
         left = interval.left
         right = intersections[0].left
@@ -0,0 +1,658 @@
+import contextlib
+import copy
+import gc
+import io
+import itertools
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+from basic import *
+from kserver import *
+from main import generate_kserver
+from engine import run_sequence, run_sequence_parallel
+from mass import *
+from raster import *
+from export import FrameRenderer
+
+
+def _count_allocations(func, repeat):
+    """Count the memory blocks still allocated after calling func repeatedly. The results
+    of the calls are kept alive so that the objects they allocate are counted.
+
+    Args:
+        func (:obj:`callable`): A function without arguments.
+        repeat (int): The number of calls.
+
+    Returns:
+        float: The average number of allocated blocks per call.
+    """
+    results = []
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for _ in range(repeat):
+        results.append(func())
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, 'lineno')
+                 if stat.count_diff > 0)
+    return blocks / repeat
+
+
+def _count_intervals_sets(func):
+    """Count the IntervalsSet objects created while calling func.
+
+    Args:
+        func (:obj:`callable`): A function without arguments.
+
+    Returns:
+        int: The number of IntervalsSet objects created.
+    """
+    count = [0]
+    init = IntervalsSet.__init__
+    from_arrays = IntervalsSet.from_arrays.__func__
+
+    def counting_init(self, intervals):
+        count[0] += 1
+        init(self, intervals)
+
+    def counting_from_arrays(cls, left, right):
+        count[0] += 1
+        return from_arrays(cls, left, right)
+
+    IntervalsSet.__init__ = counting_init
+    IntervalsSet.from_arrays = classmethod(counting_from_arrays)
+    try:
+        func()
+    finally:
+        IntervalsSet.__init__ = init
+        IntervalsSet.from_arrays = classmethod(from_arrays)
+    return count[0]
+
+
+def _random_walk(n, steps, walker, seed=0):
+    rng = random.Random(seed)
+    sequence = []
+    p = [rng.randrange(n) for _ in range(walker)]
+    for _ in range(steps):
+        mass = [0] * n
+        for j in p:
+            mass[j] += 1
+        sequence.append(mass)
+        p = [j + 1 if j <= 0 else j - 1 if j >= n - 1 else j + rng.choice([1, -1]) for j in p]
+    return sequence
+
+
+def bench_interval_intersect(N=10):
+    """Time Interval.intersect on the pairs of intervals compared when refining level i of a
+    depth-N dyadic tree by the semi-partition of level i + 1, and count the blocks allocated
+    per overlapping intersection.
+
+    Args:
+        N (int): The depth of the tree built by generate_kserver.
+    """
+    ks = generate_kserver(N)
+    levels = []
+    for sc in ks.semi_clusterings:
+        levels.append([itv for cluster in sc.clusters for s in cluster.sets for itv in s.data])
+
+    count = 0
+    start = time.perf_counter()
+    for i in range(len(levels) - 1):
+        for itv1 in levels[i]:
+            for itv2 in levels[i + 1]:
+                itv1.intersect(itv2)
+                count += 1
+    elapsed = time.perf_counter() - start
+    print('Interval.intersect: %d calls, %.3f us/call' % (count, elapsed / count * 1e6))
+
+    itv1 = levels[N - 1][0]
+    itv2 = levels[N][0]
+    repeat = 100000
+    start = time.perf_counter()
+    for _ in range(repeat):
+        itv1.intersect(itv2)
+    elapsed = time.perf_counter() - start
+    blocks = _count_allocations(lambda: itv1.intersect(itv2), 10000)
+    print('Interval.intersect (overlapping): %.3f us/call, %.2f blocks/call'
+          % (elapsed / repeat * 1e6, blocks))
+
+
+def bench_kserver_operations(N=8):
+    """Time insert, delete, fusion and fission on every level of a depth-N dyadic tree and
+    count the IntervalsSet objects created per operation.
+
+    Args:
+        N (int): The depth of the tree built by generate_kserver.
+    """
+    ks = generate_kserver(N)
+    operations = {'fusion': [], 'fission': [], 'delete': [], 'insert': []}
+    for j in range(1, N + 1):
+        operations['fusion'].append(lambda j=j: ks.fusion(j, 0, 1))
+        operations['fission'].append(lambda j=j: ks.fission(j, 0))
+        operations['delete'].append(lambda j=j: ks.delete(j, 1 - 2**(-j) / 2))
+        operations['insert'].append(lambda j=j: ks.insert(j, Interval(1 - 2**(-j), 1)))
+    for name, ops in operations.items():
+        elapsed = 0
+        created = 0
+        for op in ops:
+            start = time.perf_counter()
+            created += _count_intervals_sets(op)
+            elapsed += time.perf_counter() - start
+        print('KServer.%s: %.3f ms/op, %.1f IntervalsSet/op'
+              % (name, elapsed / len(ops) * 1e3, created / len(ops)))
+
+
+def bench_set_removal(sizes=(1000, 4000, 16000)):
+    """Time removing the sets of a semi-clustering in random order, with and without
+    recording the removals in a journal, both from a single cluster and from singleton
+    clusters, as in the levels of a dyadic KServer, where each removal removes a cluster.
+
+    Args:
+        sizes (:obj:`iterable` of int): The numbers of sets.
+    """
+    rng = random.Random(0)
+    for size in sizes:
+        sets = [IntervalsSet.from_arrays(np.array([k / size]), np.array([(k + 1) / size]))
+                for k in range(size)]
+        order = sets[:]
+        rng.shuffle(order)
+        for layout, clusters in (('one cluster', lambda: [Cluster(sets)]),
+                                 ('singletons', lambda: [Cluster([s]) for s in sets])):
+            for journal in (None, Journal()):
+                semi_clustering = SemiClustering(clusters())
+                semi_clustering.journal = journal
+                start = time.perf_counter()
+                for intervals_set in order[:-1]:
+                    semi_clustering.remove_set(intervals_set)
+                elapsed = time.perf_counter() - start
+                print('%d sets, %s%s: remove_set %.2f us/op'
+                      % (size, layout, '' if journal == None else ', journaled',
+                         elapsed / (size - 1) * 1e6))
+
+
+def bench_batch_operations(N=8, size=200):
+    """Compare deleting and re-inserting a batch of sets one by one against delete_many and
+    insert_many on a depth-N dyadic tree.
+
+    Args:
+        N (int): The depth of the tree built by generate_kserver.
+        size (int): The number of sets deleted and re-inserted.
+    """
+    rng = random.Random(0)
+    deletes = []
+    inserts = []
+    for k in rng.sample(range(2**N), size):
+        deletes.append((N, (k + 0.5) / 2**N))
+        inserts.append((N, Interval(k / 2**N, (k + 1) / 2**N)))
+
+    ks = generate_kserver(N)
+    start = time.perf_counter()
+    for j, x in deletes:
+        ks.delete(j, x)
+    for j, interval in inserts:
+        ks.insert(j, interval)
+    sequential = time.perf_counter() - start
+
+    ks = generate_kserver(N)
+    start = time.perf_counter()
+    ks.delete_many(deletes)
+    ks.insert_many(inserts)
+    batch = time.perf_counter() - start
+    print('%d deletes + %d inserts: sequential %.3f s, batch %.3f s'
+          % (size, size, sequential, batch))
+
+
+def bench_traversals(Ns=range(4, 17), depth=3000):
+    """Measure the throughput of the tree traversals on generate_kserver(N) trees, and build
+    a chain of the given depth to exercise traversals deeper than the recursion limit.
+
+    Args:
+        Ns (:obj:`iterable` of int): The depths of the dyadic trees.
+        depth (int): The number of levels of the chain.
+    """
+    def uniform(itv):
+        return max(0, min(itv.right, 1) - max(itv.left, 0))
+
+    for N in Ns:
+        start = time.perf_counter()
+        ks = generate_kserver(N)
+        build = time.perf_counter() - start
+        nodes = 2**(N + 1) - 1
+
+        start = time.perf_counter()
+        ks._find_heavy(ks.tree.root, uniform, 0.5, 1, 0, [])
+        heavy = time.perf_counter() - start
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ks.print_tree()
+        printing = time.perf_counter() - start
+        print('N=%d: %d nodes, build %.3f s, _find_heavy %.0f nodes/s, print_tree %.0f nodes/s'
+              % (N, nodes, build, nodes / heavy, nodes / printing))
+
+    sps = [SemiPartition([IntervalsSet([Interval(0, 1)])]) for _ in range(depth)]
+    start = time.perf_counter()
+    ks = KServer(sps)
+    ks._find_heavy(ks.tree.root, uniform, 2, 1, 0, [])
+    print('chain of depth %d: build and _find_heavy %.3f s'
+          % (depth, time.perf_counter() - start))
+
+
+def bench_tree_memory(N=10):
+    """Compare the memory per node and the construction time of the Tree and FlatTree
+    backends on a depth-N dyadic tree.
+
+    Args:
+        N (int): The depth of the tree built by generate_kserver.
+    """
+    nodes = 2**(N + 1) - 1
+    for tree_type in (Tree, FlatTree):
+        start = time.perf_counter()
+        ks = generate_kserver(N, tree_type)
+        build = time.perf_counter() - start
+        gc.collect()
+        tracemalloc.start()
+        tree = copy.deepcopy(ks.tree, {id(s): s for sc in ks.semi_clusterings
+                                       for cluster in sc.clusters for s in cluster.sets})
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        del tree
+        print('%s: %d nodes, %.0f bytes/node, build %.3f s'
+              % (tree_type.__name__, nodes, size / nodes, build))
+
+
+def bench_construction(Ns=range(8, 17, 2)):
+    """Compare forming a dyadic KServer by refinement of its semi-partitions, by
+    KServer.dyadic and by cloning a pristine one.
+
+    Args:
+        Ns (:obj:`iterable` of int): The depths of the dyadic trees.
+    """
+    for N in Ns:
+        sps = [SemiPartition([IntervalsSet([Interval(k / 2**i, (k + 1) / 2**i)])
+                              for k in range(2**i)]) for i in range(N + 1)]
+        start = time.perf_counter()
+        KServer(sps)
+        refinement = time.perf_counter() - start
+        start = time.perf_counter()
+        ks = KServer.dyadic(N)
+        dyadic = time.perf_counter() - start
+        start = time.perf_counter()
+        ks.clone()
+        clone = time.perf_counter() - start
+        print('N=%d: refinement %.3f s, dyadic %.3f s, clone %.3f s'
+              % (N, refinement, dyadic, clone))
+
+
+def bench_parallel_construction(N=14):
+    """Compare refining a depth-N dyadic KServer in this process against refining its
+    subtrees in increasing numbers of worker processes, up to the number of CPUs.
+
+    Args:
+        N (int): The depth of the dyadic semi-partitions.
+    """
+    sps = [SemiPartition([IntervalsSet([Interval(k / 2**i, (k + 1) / 2**i)])
+                          for k in range(2**i)]) for i in range(N + 1)]
+    start = time.perf_counter()
+    KServer(sps)
+    serial = time.perf_counter() - start
+    print('N=%d: serial refinement %.3f s' % (N, serial))
+    cpus = os.cpu_count() or 1
+    workers = 2
+    while True:
+        start = time.perf_counter()
+        KServer(sps, workers=workers)
+        elapsed = time.perf_counter() - start
+        print('N=%d: %d workers %.3f s, speedup %.2f' % (N, workers, elapsed, serial / elapsed))
+        if workers >= cpus:
+            break
+        workers = min(2 * workers, cpus)
+
+
+def bench_serialization(Ns=range(8, 17, 4)):
+    """Compare forming a dyadic KServer by refinement and by KServer.dyadic against
+    loading a saved one, with and without mapping the file into memory, for both tree
+    backends.
+
+    Args:
+        Ns (:obj:`iterable` of int): The depths of the dyadic trees.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'kserver.bin')
+        for N in Ns:
+            sps = [SemiPartition([IntervalsSet([Interval(k / 2**i, (k + 1) / 2**i)])
+                                  for k in range(2**i)]) for i in range(N + 1)]
+            start = time.perf_counter()
+            KServer(sps)
+            refinement = time.perf_counter() - start
+            for tree_type in (Tree, FlatTree):
+                start = time.perf_counter()
+                ks = KServer.dyadic(N, tree_type)
+                dyadic = time.perf_counter() - start
+                start = time.perf_counter()
+                ks.save(path)
+                save = time.perf_counter() - start
+                del ks
+                loads = []
+                for mmap in (True, False):
+                    start = time.perf_counter()
+                    KServer.load(path, tree_type, mmap)
+                    loads.append(time.perf_counter() - start)
+                print('N=%d %s: refinement %.3f s, dyadic %.3f s, save %.3f s (%.1f MB), '
+                      'load %.3f s mapped, %.3f s read'
+                      % (N, tree_type.__name__, refinement, dyadic, save,
+                         os.path.getsize(path) / 2**20, loads[0], loads[1]))
+
+
+def bench_snapshot(Ns=range(8, 15, 2), frames=20):
+    """Compare three ways of starting each frame of a mass sequence from the pristine
+    depth-N dyadic KServer before fusing its heavy clusters: rebuilding it, cloning it and
+    restoring a snapshot of it.
+
+    Args:
+        Ns (:obj:`iterable` of int): The depths of the dyadic trees.
+        frames (int): The number of frames.
+    """
+    rng = random.Random(0)
+    masses = [generate_mass_from_list([rng.random()**3 for _ in range(40)])
+              for _ in range(frames)]
+    for N in Ns:
+        base = KServer.dyadic(N)
+        baseline = base.snapshot()
+        forks = {'rebuild': lambda: KServer.dyadic(N), 'clone': base.clone}
+        for name, fork in forks.items():
+            elapsed = 0
+            for mass in masses:
+                start = time.perf_counter()
+                ks = fork()
+                elapsed += time.perf_counter() - start
+                for _ in ks.fuse_heavy_generator(mass, 0.5, 1):
+                    pass
+            print('N=%d: %s %.3f ms/frame' % (N, name, elapsed / frames * 1e3))
+        elapsed = 0
+        changes = 0
+        for mass in masses:
+            for _ in base.fuse_heavy_generator(mass, 0.5, 1):
+                pass
+            changes += len(base._journal.entries) - baseline
+            start = time.perf_counter()
+            base.restore(baseline)
+            elapsed += time.perf_counter() - start
+        print('N=%d: restore %.3f ms/frame, %.0f changes/frame'
+              % (N, elapsed / frames * 1e3, changes / frames))
+
+
+def bench_incremental_heavy(N=10, n=41, steps=45, walker=5):
+    """Compare fusing the heavy clusters of each frame of a random walk mass sequence from
+    a restored snapshot with fuse_heavy_generator against HeavyTracker, and count the
+    intervals the mass functions are evaluated on.
+
+    Args:
+        N (int): The depth of the tree built by generate_kserver.
+        n (int): The number of points of the mass lists.
+        steps (int): The number of frames.
+        walker (int): The number of walkers.
+    """
+    sequence = _random_walk(n, steps, walker)
+    calls = [0]
+
+    def counted(mass_list):
+        mf = generate_mass_from_list(mass_list)
+
+        def counting_mf(itv):
+            calls[0] += 1
+            return mf(itv)
+
+        def counting_batch(lefts, rights):
+            calls[0] += len(lefts)
+            return mf.batch(lefts, rights)
+        counting_mf.batch = counting_batch
+        return counting_mf
+
+    ks = generate_kserver(N)
+    baseline = ks.snapshot()
+    start = time.perf_counter()
+    for mass_list in sequence:
+        ks.restore(baseline)
+        for _ in ks.fuse_heavy_generator(counted(mass_list), 0.9, 4):
+            pass
+    full = time.perf_counter() - start
+    full_calls = calls[0]
+
+    calls[0] = 0
+    tracker = HeavyTracker(generate_kserver(N), 0.9, 4)
+    start = time.perf_counter()
+    prev = None
+    for mass_list in sequence:
+        tracker.update(counted(mass_list),
+                       None if prev is None else mass_list_changes(prev, mass_list))
+        prev = mass_list
+    incremental = time.perf_counter() - start
+    print('%d frames: full %.3f s (%d masses), incremental %.3f s (%d masses)'
+          % (steps, full, full_calls, incremental, calls[0]))
+
+
+def bench_mass_evaluation(Ns=range(8, 17, 4)):
+    """Compare _find_heavy with a mass function evaluated interval by interval against
+    the same mass function evaluated in one batched call.
+
+    Args:
+        Ns (:obj:`iterable` of int): The depths of the dyadic trees.
+    """
+    rng = random.Random(0)
+    mf = generate_mass_from_list([rng.random() for _ in range(41)])
+
+    def scalar_mf(itv):
+        return mf(itv)
+
+    for N in Ns:
+        ks = generate_kserver(N)
+        ks._node_intervals(ks.tree.root, 0)     # materialize the intervals of the nodes
+        timings = []
+        for mass in (scalar_mf, mf):
+            start = time.perf_counter()
+            ks._find_heavy(ks.tree.root, mass, 0.9, 4, 0, [])
+            timings.append(time.perf_counter() - start)
+        print('N=%d: _find_heavy scalar %.3f s, batched %.3f s' % (N, timings[0], timings[1]))
+
+
+def bench_mass_pyramid(N=16, sizes=(41, 10**4, 10**6)):
+    """Compare evaluating the masses of the nodes of a depth-N dyadic tree and of their
+    neighbourhoods by searching the prefix sums of the mass list against building the mass
+    pyramid and looking the nodes up in it, for mass lists of the given sizes.
+
+    Args:
+        N (int): The depth of the tree built by generate_kserver.
+        sizes (:obj:`iterable` of int): The lengths of the mass lists.
+    """
+    ks = generate_kserver(N)
+    nodes = ks._node_intervals(ks.tree.root, 0)
+    levels = np.array([level for level, _ in nodes] * 2)
+    lefts, rights, n_lefts, n_rights = ks._neighbourhoods(nodes, 4)
+    lefts = np.concatenate((lefts, n_lefts))
+    rights = np.concatenate((rights, n_rights))
+    location = MassPyramid.locate(N, levels, lefts, rights)
+    rng = np.random.default_rng(0)
+    for size in sizes:
+        mf = generate_mass_from_list(rng.random(size).tolist())
+        start = time.perf_counter()
+        batch_mass(mf, lefts, rights)
+        search = time.perf_counter() - start
+        start = time.perf_counter()
+        MassPyramid(mf, N).lookup(location, lefts, rights)
+        pyramid = time.perf_counter() - start
+        print('N=%d, %d points: prefix sum search %.4f s, pyramid %.4f s'
+              % (N, size, search, pyramid))
+
+
+def bench_streaming(frames=20000, n=41):
+    """Compare the peak memory of forming the mass functions and changed points of a
+    sequence of mass lists up front against streaming them from a memory-mapped .npy file.
+
+    Args:
+        frames (int): The number of mass lists.
+        n (int): The number of points of the mass lists.
+    """
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'sequence.npy')
+        np.save(path, rng.integers(0, 3, size=(frames, n)).astype(float) + 1)
+
+        def eager():
+            sequence = np.load(path).tolist()
+            mass_funcs = [generate_mass_from_list(l) for l in sequence]
+            changes = [None] + [mass_list_changes(sequence[i - 1], sequence[i])
+                                for i in range(1, len(sequence))]
+            for mf, points in zip(mass_funcs, changes):
+                pass
+
+        def streaming():
+            lists, previous_lists = itertools.tee(load_mass_sequence(path))
+            mass_funcs = (generate_mass_from_list(l) for l in lists)
+            for mf, points in zip(mass_funcs, mass_sequence_changes(previous_lists)):
+                pass
+
+        for name, func in (('up front', eager), ('streaming', streaming)):
+            gc.collect()
+            tracemalloc.start()
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print('%d frames %s: %.3f s, peak %.1f MB' % (frames, name, elapsed, peak / 2**20))
+
+
+def bench_engine(N=8, steps=1000):
+    """Compare the throughput of run_sequence on a random walk mass sequence against
+    building a KServer and exhausting fuse_heavy_generator for each frame, as the
+    animation did.
+
+    Args:
+        N (int): The depth of the dyadic KServer.
+        steps (int): The number of frames.
+    """
+    sequence = _random_walk(41, steps, 5)
+    start = time.perf_counter()
+    for mass_list in sequence:
+        ks = generate_kserver(N)
+        for _ in ks.fuse_heavy_generator(generate_mass_from_list(mass_list), 0.9, 4):
+            pass
+    rebuild = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in run_sequence(sequence, N, 0.9, 4):
+        pass
+    engine = time.perf_counter() - start
+    print('%d frames: rebuild %.0f frames/s, run_sequence %.0f frames/s'
+          % (steps, steps / rebuild, steps / engine))
+
+
+def bench_parallel(N=8, steps=2000):
+    """Compare the serial run_sequence against run_sequence_parallel with increasing
+    numbers of worker processes, up to the number of CPUs, on a random walk mass sequence.
+
+    Args:
+        N (int): The depth of the dyadic KServer.
+        steps (int): The number of frames.
+    """
+    sequence = _random_walk(41, steps, 5)
+    start = time.perf_counter()
+    for _ in run_sequence(sequence, N, 0.9, 4):
+        pass
+    serial = time.perf_counter() - start
+    print('%d frames: serial %.3f s' % (steps, serial))
+    cpus = os.cpu_count() or 1
+    workers = 1
+    while True:
+        start = time.perf_counter()
+        for _ in run_sequence_parallel(sequence, N, 0.9, 4, workers=workers):
+            pass
+        elapsed = time.perf_counter() - start
+        print('%d frames: %d workers %.3f s, speedup %.2f' % (steps, workers, elapsed,
+                                                             serial / elapsed))
+        if workers >= cpus:
+            break
+        workers = min(2 * workers, cpus)
+
+
+def bench_raster(Ns=(6, 8), w=1600, h=900, frames=20):
+    """Time rasterizing the mass function and the tree of a fused dyadic KServer, which
+    replaces drawing a canvas item per interval of each node and per bar of the mass
+    function.
+
+    Args:
+        Ns (:obj:`iterable` of int): The depths of the dyadic KServers.
+        w (int): The width of the image.
+        h (int): The height of the image.
+        frames (int): The number of frames to time.
+    """
+    raster = Raster(Layout(w, h), color_table('YlGnBu'))
+    rng = random.Random(0)
+    mass_f = generate_mass_from_list([rng.random() ** 3 for _ in range(41)])
+    for N in Ns:
+        kserver = generate_kserver(N)
+        for _ in kserver.fuse_heavy_generator(mass_f, 0.5, 1):
+            pass
+        nodes = tree_nodes(kserver.tree)
+        masses = node_masses(nodes, mass_f)
+        intervals = sum(len(content.left) for node_data, _, _ in nodes
+                        for content, _ in node_data)
+        start = time.perf_counter()
+        for _ in range(frames):
+            raster.draw_mass(mass_f)
+            raster.draw_tree(nodes, masses, 0.01)
+            raster.ppm()
+        elapsed = time.perf_counter() - start
+        print('N=%d: %d nodes, %d intervals, raster %.2f ms/frame'
+              % (N, len(nodes), intervals, elapsed / frames * 1e3))
+
+
+def bench_export(N=8, steps=50):
+    """Time the stages of rendering a frame of a random walk mass sequence without a
+    display: fusing and rasterizing, composing with the axes and writing a PNG file.
+
+    Args:
+        N (int): The depth of the dyadic KServer.
+        steps (int): The number of frames.
+    """
+    sequence = _random_walk(41, steps, 5)
+    renderer = FrameRenderer(generate_kserver(N))
+    times = [0, 0, 0]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'frame.png')
+        for mass_list in sequence:
+            start = time.perf_counter()
+            renderer.render(mass_list)
+            times[0] += time.perf_counter() - start
+            start = time.perf_counter()
+            renderer.compose()
+            times[1] += time.perf_counter() - start
+            start = time.perf_counter()
+            renderer.save_png(path)
+            times[2] += time.perf_counter() - start
+    print('%d frames: render %.1f ms, compose %.1f ms, PNG %.1f ms per frame'
+          % ((steps,) + tuple(t / steps * 1e3 for t in times)))
+
+
+if __name__ == '__main__':
+    bench_interval_intersect()
+    bench_kserver_operations()
+    bench_set_removal()
+    bench_batch_operations()
+    bench_traversals()
+    bench_tree_memory()
+    bench_construction()
+    bench_parallel_construction()
+    bench_serialization()
+    bench_snapshot()
+    bench_incremental_heavy()
+    bench_mass_evaluation()
+    bench_mass_pyramid()
+    bench_streaming()
+    bench_engine()
+    bench_parallel()
+    bench_raster()
+    bench_export()
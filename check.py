@@ -0,0 +1,173 @@
+import os
+import random
+import tempfile
+from basic import *
+from kserver import *
+from mass import *
+
+
+def describe(ks):
+    """Describe the state of the given KServer object, independently of the order of the
+    children of the tree nodes and of the numbering of the nodes.
+
+    Args:
+        ks (:obj:`KServer`): The KServer object.
+
+    Returns:
+        :obj:`list`: The clusters of each semi-clustering, followed by the tree.
+    """
+    def describe_set(intervals_set):
+        # read from the endpoint arrays, which may map a file, rather than from the
+        # intervals cached by IntervalsSet.data
+        return list(zip(intervals_set.left.tolist(), intervals_set.right.tolist()))
+
+    def describe_node(node):
+        return (sorted((describe_set(content), describe_set(origin))
+                       for content, origin in ks.tree.data(node)),
+                sorted(describe_node(child) for child in ks.tree.children(node)))
+
+    result = [[[describe_set(intervals_set) for intervals_set in cluster.sets]
+               for cluster in semi_clustering.clusters]
+              for semi_clustering in ks.semi_clusterings]
+
+    result.append(describe_node(ks.tree.root))
+    return result
+
+
+def random_operation(ks, rng):
+    """Draw a random insertion, deletion, fusion or fission for the given KServer object.
+
+    Returns:
+        :obj:`tuple`: The name of the KServer method followed by its arguments.
+    """
+    j = rng.randrange(1, len(ks.semi_clusterings))
+    count = len(ks.semi_clusterings[j].clusters)
+    kind = rng.choice(['insert', 'delete', 'fusion', 'fission'])
+    if kind == 'insert' or count == 0:
+        left = rng.randrange(0, 16)
+        return 'insert', j, Interval(left / 16, rng.randrange(left + 1, 17) / 16)
+    if kind == 'delete':
+        return 'delete', j, rng.randrange(0, 33) / 32
+    if kind == 'fusion':
+        return 'fusion', j, rng.randrange(count), rng.randrange(count)
+    return 'fission', j, rng.randrange(count)
+
+
+def apply_operation(ks, operation):
+    """Apply an operation drawn by random_operation, ignoring it if it is invalid."""
+    try:
+        getattr(ks, operation[0])(*operation[1:])
+    except Exception:
+        pass
+
+
+def check_snapshots(tree_type, seeds=20, steps=80):
+    """Check that restoring a snapshot gives the same state as replaying the operations
+    made before it on a fresh KServer.
+    """
+    for seed in range(seeds):
+        rng = random.Random(seed)
+        ks = KServer.dyadic(4, tree_type)
+        operations = []
+        snapshots = []
+        for _ in range(steps):
+            choice = rng.random()
+            if choice < 0.1:
+                snapshots.append((ks.snapshot(), len(operations)))
+            elif choice < 0.2 and len(snapshots) > 0:
+                k = rng.randrange(len(snapshots))
+                snapshot, count = snapshots[k]
+                ks.restore(snapshot)
+                del snapshots[k + 1:]
+                del operations[count:]
+                replay = KServer.dyadic(4, tree_type)
+                for operation in operations:
+                    apply_operation(replay, operation)
+                if describe(ks) != describe(replay):
+                    raise Exception('snapshot restored differs from replay, seed %d' % seed)
+            else:
+                operations.append(random_operation(ks, rng))
+                apply_operation(ks, operations[-1])
+
+
+def check_batches(tree_type, seeds=100):
+    """Check that apply_batch gives the same state, and fails on the same operation, as
+    applying the insertions and deletions one by one.
+    """
+    for seed in range(seeds):
+        rng = random.Random(seed)
+        ks = KServer.dyadic(4, tree_type)
+        batched = KServer.dyadic(4, tree_type)
+        for _ in range(4):
+            # fusions make the tree irregular
+            for _ in range(3):
+                j = rng.randrange(1, 5)
+                count = len(ks.semi_clusterings[j].clusters)
+                if count >= 2:
+                    a, b = rng.sample(range(count), 2)
+                    ks.fusion(j, a, b)
+                    batched.fusion(j, a, b)
+            operations = []
+            for _ in range(rng.randrange(1, 8)):
+                j = rng.randrange(1, 5)
+                if rng.random() < 0.5:
+                    left = rng.randrange(0, 32)
+                    interval = Interval(left / 32, rng.randrange(left + 1, 33) / 32)
+                    operations.append(('insert', j, interval))
+                else:
+                    operations.append(('delete', j, rng.randrange(0, 65) / 64))
+            error = batched_error = None
+            for operation in operations:
+                try:
+                    getattr(ks, operation[0])(*operation[1:])
+                except Exception as e:
+                    error = str(e)
+                    break
+            try:
+                batched.apply_batch(operations)
+            except Exception as e:
+                batched_error = str(e)
+            if error != batched_error or describe(ks) != describe(batched):
+                raise Exception('batch differs from single operations, seed %d' % seed)
+
+
+def check_save_load(tree_type, load_tree_type, mmap, seeds=3):
+    """Check that a KServer loaded from a file has the state that was saved, and that
+    saving over the file, the loaded KServer itself or another one, leaves the loaded
+    KServer unchanged even if it maps the file.
+    """
+    rng = random.Random(0)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'kserver.bin')
+        for _ in range(seeds):
+            ks = KServer.dyadic(6, tree_type)
+            mass_f = generate_mass_from_list([rng.random() ** 4 for _ in range(40)])
+            for _ in ks.fuse_heavy_generator(mass_f, 0.5, 2):
+                pass
+            ks.save(path)
+            loaded = KServer.load(path, load_tree_type, mmap)
+            if describe(loaded) != describe(ks):
+                raise Exception('loaded KServer differs from the saved one')
+            for j in range(1, len(loaded.semi_clusterings)):
+                if len(loaded.semi_clusterings[j].clusters) > 2:
+                    loaded.fusion(j, 0, 2)
+            for _ in range(20):
+                apply_operation(loaded, random_operation(loaded, rng))
+            state = describe(loaded)
+            loaded.save(path)
+            if describe(loaded) != state:
+                raise Exception('saving a loaded KServer over its file modified it')
+            if describe(KServer.load(path, load_tree_type, mmap)) != state:
+                raise Exception('KServer saved over its file differs when loaded')
+            KServer.dyadic(4, tree_type).save(path)
+            if describe(loaded) != state:
+                raise Exception('saving another KServer over the file modified a loaded one')
+
+
+for tree_type in (Tree, FlatTree):
+    check_snapshots(tree_type)
+    check_batches(tree_type)
+    for load_tree_type in (Tree, FlatTree):
+        for mmap in (True, False):
+            check_save_load(tree_type, load_tree_type, mmap)
+    print('%s: ok' % tree_type.__name__)
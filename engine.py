@@ -0,0 +1,186 @@
+import argparse
+import collections
+import itertools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from basic import *
+from kserver import *
+from mass import *
+
+
+class FrameResult:
+    """The outcome of fusing the heavy clusters for one mass distribution of a sequence.
+
+    The clusters are stored in flat arrays, which are cheap to pickle when results are
+    sent back from worker processes, and expanded into nested lists on access.
+
+    Attributes:
+        index (int): The position of the distribution in the sequence.
+        heavy_list (:obj:`list` of :obj:`tuple`): The (level, left, right) triples of the
+            heavy intervals, in the order they were fused.
+        lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals of all sets, in
+            the order of the semi-clusterings, their clusters and their sets.
+        rights (:obj:`numpy.ndarray`): The right endpoints of the intervals of all sets.
+        set_sizes (:obj:`numpy.ndarray`): The number of intervals of each set.
+        cluster_sizes (:obj:`numpy.ndarray`): The number of sets of each cluster.
+        level_sizes (:obj:`numpy.ndarray`): The number of clusters of each semi-clustering.
+    """
+
+    def __init__(self, index, heavy_list, structure):
+        self.index = index
+        self.heavy_list = heavy_list
+        (self.lefts, self.rights, self.set_sizes,
+         self.cluster_sizes, self.level_sizes) = structure
+
+    @property
+    def clusters(self):
+        """:obj:`list` of :obj:`list`: The clusters of each semi-clustering. A cluster is a
+        list of sets and a set is a list of (left, right) pairs."""
+        groups = list(zip(self.lefts.tolist(), self.rights.tolist()))
+        for sizes in (self.set_sizes, self.cluster_sizes, self.level_sizes):
+            grouped = []
+            start = 0
+            for size in sizes.tolist():
+                grouped.append(groups[start:start + size])
+                start += size
+            groups = grouped
+        return groups
+
+    def to_dict(self):
+        return {'index': self.index, 'heavy_list': self.heavy_list, 'clusters': self.clusters}
+
+
+def run_sequence(sequence, N, alpha, r, tree_type=Tree, start=0):
+    """Fuse the heavy clusters of the dyadic KServer of depth N for each mass distribution
+    of a sequence, without any drawing or delay. Each distribution starts from the
+    pristine KServer, as in the animation, and the work shared with the previous
+    distribution is reused by a HeavyTracker.
+
+    Args:
+        sequence (:obj:`iterable` of `List` or str): The mass distributions, as given to
+            main.animate_mass_sequence. It is consumed lazily.
+        N (int): The depth of the dyadic KServer.
+        alpha (float): The heaviness threshold.
+        r (float): The neighbourhood radius.
+        tree_type (:obj:`type`): The tree backend. Default to Tree.
+        start (int): The index of the first distribution. Default to 0.
+
+    Yields:
+        :obj:`FrameResult`: The result of each distribution, in order.
+    """
+    if isinstance(sequence, str):
+        sequence = load_mass_sequence(sequence)
+    tracker = HeavyTracker(KServer.dyadic(N, tree_type), alpha, r)
+    yield from _run_frames(tracker, sequence, start)
+
+
+def _run_frames(tracker, sequence, start):
+    lists, previous_lists = itertools.tee(sequence)
+    changes_sequence = mass_sequence_changes(previous_lists)
+    for index, (mass_list, changes) in enumerate(zip(lists, changes_sequence), start):
+        tracker.update(generate_mass_from_list(mass_list), changes)
+        heavy_list = [(level, itv.left, itv.right) for level, itv in tracker.heavy_list]
+        yield FrameResult(index, heavy_list, cluster_structure(tracker.kserver))
+
+
+_worker_tracker = None
+
+
+def _init_worker(kserver, alpha, r):
+    global _worker_tracker
+    _worker_tracker = HeavyTracker(kserver, alpha, r)
+
+
+def _run_chunk(start, mass_lists):
+    return list(_run_frames(_worker_tracker, mass_lists, start))
+
+
+def run_sequence_parallel(sequence, N, alpha, r, tree_type=Tree, workers=None,
+                          chunk_size=32):
+    """Run run_sequence across worker processes. The frames are independent, so the
+    sequence is cut into chunks of consecutive distributions processed by the workers,
+    each reusing the work within its chunks. The base KServer is built once and passed
+    to each worker when it starts, rather than with every chunk. At most two chunks per
+    worker are in flight, so the sequence is still consumed lazily.
+
+    Args:
+        sequence (:obj:`iterable` of `List` or str): The mass distributions, as in
+            run_sequence.
+        N (int): The depth of the dyadic KServer.
+        alpha (float): The heaviness threshold.
+        r (float): The neighbourhood radius.
+        tree_type (:obj:`type`): The tree backend. Default to Tree.
+        workers (int): The number of worker processes. Default to the number of CPUs.
+        chunk_size (int): The number of distributions per chunk. Default to 32.
+
+    Yields:
+        :obj:`FrameResult`: The result of each distribution, in the order of the sequence.
+    """
+    if isinstance(sequence, str):
+        sequence = load_mass_sequence(sequence)
+    if workers == None:
+        workers = os.cpu_count() or 1
+    base = KServer.dyadic(N, tree_type)
+    yield from run_chunks(sequence, _run_chunk, workers, chunk_size, _init_worker,
+                          (base, alpha, r))
+
+
+def run_chunks(sequence, function, workers, chunk_size, initializer, initargs):
+    """Cut a sequence into chunks of consecutive items and process them across worker
+    processes. At most two chunks per worker are in flight, so the sequence is consumed
+    lazily.
+
+    Args:
+        sequence (:obj:`iterable`): The items.
+        function (:obj:`callable`): Called in a worker with the index of the first item
+            of a chunk and the list of its items, and returns the list of their results.
+            It must be picklable.
+        workers (int): The number of worker processes.
+        chunk_size (int): The number of items per chunk.
+        initializer (:obj:`callable`): Called in each worker when it starts.
+        initargs (:obj:`tuple`): The arguments of the initializer.
+
+    Yields:
+        The result of each item, in the order of the sequence.
+    """
+    iterator = iter(sequence)
+    with ProcessPoolExecutor(max_workers=workers, initializer=initializer,
+                             initargs=initargs) as executor:
+        pending = collections.deque()
+        start = 0
+        while True:
+            while len(pending) < 2 * workers:
+                chunk = list(itertools.islice(iterator, chunk_size))
+                if len(chunk) == 0:
+                    break
+                pending.append(executor.submit(function, start, chunk))
+                start += len(chunk)
+            if len(pending) == 0:
+                break
+            yield from pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Fuse the heavy clusters for each mass distribution of a CSV or .npy '
+                    'file and write one JSON object per distribution.')
+    parser.add_argument('sequence', help='the CSV or .npy file of mass distributions')
+    parser.add_argument('-N', type=int, default=8, help='the depth of the dyadic KServer')
+    parser.add_argument('--alpha', type=float, default=0.9, help='the heaviness threshold')
+    parser.add_argument('-r', type=float, default=4, help='the neighbourhood radius')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='the number of worker processes, 0 for one per CPU')
+    args = parser.parse_args(argv)
+    if args.workers == 1:
+        results = run_sequence(args.sequence, args.N, args.alpha, args.r)
+    else:
+        results = run_sequence_parallel(args.sequence, args.N, args.alpha, args.r,
+                                        workers=args.workers or None)
+    for result in results:
+        sys.stdout.write(json.dumps(result.to_dict()) + '\n')
+
+
+if __name__ == '__main__':
+    main()
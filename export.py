@@ -0,0 +1,282 @@
+import argparse
+import functools
+import itertools
+import os
+import subprocess
+import numpy as np
+import matplotlib
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from matplotlib.lines import Line2D
+from matplotlib.transforms import IdentityTransform
+from PIL import Image
+from basic import *
+from engine import run_chunks
+from kserver import *
+from mass import *
+from raster import *
+
+
+class FrameRenderer:
+    """Render the frames of the animation of main.App without a display. Each frame is
+    rasterized by a Raster and composed with the axes of the mass function, which the
+    Agg backend of matplotlib draws once, as redrawing a whole figure for each frame would
+    take several times longer than rasterizing it.
+
+    Attributes:
+        tracker (:obj:`HeavyTracker`): The tracker fusing the heavy clusters of the
+            KServer for each mass distribution. `None` if the renderer only composes
+            frames rendered elsewhere.
+        small_alpha (float): The mass below which nodes are drawn in light gray.
+        layout (:obj:`Layout`): The size of the frames and the positions and sizes of
+            the elements.
+        raster (:obj:`Raster`): The rasterized mass function and tree of the last frame.
+            `None` if the renderer only composes frames.
+        frame (:obj:`numpy.ndarray`): The h x w x 3 pixels of the last frame composed.
+    """
+
+    def __init__(self, kserver, big_alpha=0.9, small_alpha=0.01, r=4, w=1600, h=900,
+                 mass_scale=0.7, dpi=100):
+        """
+        Args:
+            kserver (:obj:`KServer`): The KServer whose clusters are fused. It must not be
+                modified outside of the renderer. `None` for a renderer that only
+                composes frames rendered elsewhere.
+            big_alpha (float): The heaviness threshold. Default to 0.9.
+            small_alpha (float): The mass below which nodes are drawn in light gray.
+                Default to 0.01.
+            r (float): The neighbourhood radius. Default to 4.
+            w (int): The width of the frames in pixels. Default to 1600.
+            h (int): The height of the frames in pixels. Default to 900.
+            mass_scale (float): The display scale of the mass function. Default to 0.7.
+            dpi (float): The resolution at which the labels are drawn. Default to 100.
+        """
+        self.small_alpha = small_alpha
+        self.layout = Layout(w, h, mass_scale)
+        if kserver != None:
+            self.tracker = HeavyTracker(kserver, big_alpha, r)
+            self.raster = Raster(self.layout, color_table('YlGnBu'))
+        else:
+            self.tracker = self.raster = None
+        self.frame = np.empty((h, w, 3), dtype=np.uint8)
+        self._overlay = self._draw_axes(dpi)
+
+    def _draw_axes(self, dpi):
+        # the axes and labels of main.Drawing, in pixels from the bottom left corner of a
+        # transparent figure
+        layout = self.layout
+        figure = Figure(figsize=(layout.w / dpi, layout.h / dpi), dpi=dpi,
+                        facecolor=(0, 0, 0, 0))
+        canvas = FigureCanvasAgg(figure)
+        width = layout._scale(4) * 72 / dpi
+        y0 = layout.h - layout.mass_y0
+        for xs, ys in (([layout.x0, layout.x0 + layout.scale], [y0, y0]),
+                       ([layout.x0, layout.x0], [y0, y0 + layout.mass_height])):
+            figure.add_artist(Line2D(xs, ys, linewidth=width, color='black',
+                                     transform=IdentityTransform()))
+        x = layout.x0 - layout._scale(25, type='w')
+        for y, label in ((y0, 0), (y0 + layout.mass_height, layout.mass_scale)):
+            figure.text(x, y, str(label), fontsize=layout._scale(14), family='monospace',
+                        ha='center', va='center', transform=IdentityTransform())
+        canvas.draw()
+        rgba = np.asarray(canvas.buffer_rgba())
+        rows, columns = np.nonzero(rgba[:, :, 3])
+        alpha = rgba[rows, columns, 3:] / 255
+        return rows, columns, rgba[rows, columns, :3] * alpha, 1 - alpha
+
+    def render(self, mass_list, changes=None):
+        """Fuse the heavy clusters for a mass distribution and rasterize the frame.
+
+        Args:
+            mass_list (`List`): The mass distribution, as in main.animate_mass_sequence.
+            changes (:obj:`tuple`): The positions at which the distribution differs from
+                the previous one, as returned by mass_list_changes. `None` if unknown.
+
+        Returns:
+            :obj:`numpy.ndarray`: The h x w x 3 pixels of the mass function and the tree,
+            without the axes. It is overwritten by the next frame.
+        """
+        mass_f = generate_mass_from_list(mass_list)
+        self.tracker.update(mass_f, changes)
+        nodes = tree_nodes(self.tracker.kserver.tree)
+        self.raster.draw_mass(mass_f)
+        self.raster.draw_tree(nodes, node_masses(nodes, mass_f), self.small_alpha)
+        return self.raster.image
+
+    def compose(self, image=None):
+        """Compose pixels with the axes into the frame.
+
+        Args:
+            image (:obj:`numpy.ndarray`): The pixels, as returned by render. Default to
+                those of the last frame rendered.
+
+        Returns:
+            :obj:`numpy.ndarray`: The frame. It is overwritten by the next composition.
+        """
+        self.frame[:] = self.raster.image if image is None else image
+        rows, columns, colors, weights = self._overlay
+        self.frame[rows, columns] = np.round(colors + self.frame[rows, columns] * weights)
+        return self.frame
+
+    def save_png(self, path):
+        """Save the last frame composed to a PNG file.
+
+        Args:
+            path (str): The path of the file.
+        """
+        Image.fromarray(self.frame).save(path, format='PNG')
+
+
+def _frames(renderer, sequence, start):
+    lists, previous_lists = itertools.tee(sequence)
+    changes_sequence = mass_sequence_changes(previous_lists)
+    for index, (mass_list, changes) in enumerate(zip(lists, changes_sequence), start):
+        yield index, renderer.render(mass_list, changes)
+
+
+_worker_renderer = None
+
+
+def _init_worker(kserver, options):
+    global _worker_renderer
+    _worker_renderer = FrameRenderer(kserver, **options)
+
+
+def _render_chunk(pattern, start, mass_lists):
+    if pattern == None:
+        return [image.copy() for _, image in _frames(_worker_renderer, mass_lists, start)]
+    paths = []
+    for index, _ in _frames(_worker_renderer, mass_lists, start):
+        _worker_renderer.compose()
+        paths.append(pattern % index)
+        _worker_renderer.save_png(paths[-1])
+    return paths
+
+
+def _run_chunks(sequence, N, tree_type, options, workers, chunk_size, pattern):
+    return run_chunks(sequence, functools.partial(_render_chunk, pattern), workers,
+                      chunk_size, _init_worker, (KServer.dyadic(N, tree_type), options))
+
+
+def export_frames(sequence, directory, N=8, tree_type=Tree, workers=1, chunk_size=32,
+                  pattern='frame_%06d.png', **options):
+    """Render the animation of a sequence of mass distributions to one PNG file per
+    distribution, without a display. The sequence is consumed lazily and each frame is
+    written as soon as it is rendered. With several workers, chunks of consecutive
+    distributions are rendered and written by worker processes, each starting from the
+    base KServer, as in engine.run_sequence_parallel.
+
+    Args:
+        sequence (:obj:`iterable` of `List` or str): The mass distributions, as given to
+            main.animate_mass_sequence.
+        directory (str): The directory of the files. It is created if needed.
+        N (int): The depth of the dyadic KServer. Default to 8.
+        tree_type (:obj:`type`): The tree backend. Default to Tree.
+        workers (int): The number of worker processes. `None` for the number of CPUs.
+            Default to 1, which renders in this process.
+        chunk_size (int): The number of distributions per chunk. Default to 32.
+        pattern (str): The name of the file of a frame, formatted with its index.
+            Default to 'frame_%06d.png'.
+        **options: The keyword arguments of FrameRenderer.
+
+    Yields:
+        str: The path of the file of each frame, in the order of the sequence.
+    """
+    if isinstance(sequence, str):
+        sequence = load_mass_sequence(sequence)
+    if workers == None:
+        workers = os.cpu_count() or 1
+    os.makedirs(directory, exist_ok=True)
+    pattern = os.path.join(directory, pattern)
+    if workers > 1:
+        yield from _run_chunks(sequence, N, tree_type, options, workers, chunk_size,
+                               pattern)
+        return
+    renderer = FrameRenderer(KServer.dyadic(N, tree_type), **options)
+    for index, _ in _frames(renderer, sequence, 0):
+        renderer.compose()
+        renderer.save_png(pattern % index)
+        yield pattern % index
+
+
+def export_video(sequence, path, fps=5, N=8, tree_type=Tree, workers=1, chunk_size=8,
+                 codec='libx264', **options):
+    """Render the animation of a sequence of mass distributions to a video file with
+    ffmpeg, without a display. The sequence is consumed lazily and the raw pixels of each
+    frame are piped to ffmpeg as soon as it is rendered. With several workers, the frames
+    are rasterized by worker processes, as in export_frames, and piped in order by this
+    process.
+
+    Args:
+        sequence (:obj:`iterable` of `List` or str): The mass distributions, as given to
+            main.animate_mass_sequence.
+        path (str): The path of the video file.
+        fps (float): The number of frames per second. Default to 5, the rate of
+            main.animate_mass_sequence.
+        N (int): The depth of the dyadic KServer. Default to 8.
+        tree_type (:obj:`type`): The tree backend. Default to Tree.
+        workers (int): The number of worker processes. `None` for the number of CPUs.
+            Default to 1, which renders in this process.
+        chunk_size (int): The number of distributions per chunk. Default to 8.
+        codec (str): The ffmpeg video codec. Default to 'libx264'.
+        **options: The keyword arguments of FrameRenderer.
+
+    Returns:
+        int: The number of frames written.
+    """
+    if isinstance(sequence, str):
+        sequence = load_mass_sequence(sequence)
+    if workers == None:
+        workers = os.cpu_count() or 1
+    if workers > 1:
+        # the workers rasterize the frames, which are only composed here
+        renderer = FrameRenderer(None, **options)
+        images = _run_chunks(sequence, N, tree_type, options, workers, chunk_size, None)
+    else:
+        renderer = FrameRenderer(KServer.dyadic(N, tree_type), **options)
+        images = (image for _, image in _frames(renderer, sequence, 0))
+    # the ffmpeg executable configured for matplotlib animations
+    command = [matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+               '-f', 'rawvideo', '-pix_fmt', 'rgb24',
+               '-s', '%dx%d' % (renderer.layout.w, renderer.layout.h), '-r', str(fps),
+               '-i', 'pipe:', '-vcodec', codec, '-pix_fmt', 'yuv420p', path]
+    process = subprocess.Popen(command, stdin=subprocess.PIPE)
+    count = 0
+    try:
+        for image in images:
+            process.stdin.write(renderer.compose(image).data)
+            count += 1
+    finally:
+        process.stdin.close()
+        process.wait()
+    if process.returncode != 0:
+        raise Exception('ffmpeg exited with status %d' % process.returncode)
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Render the animation of the mass distributions of a CSV or .npy file '
+                    'to PNG files, or to a video if the output has an extension.')
+    parser.add_argument('sequence', help='the CSV or .npy file of mass distributions')
+    parser.add_argument('output', help='the directory of the PNG files or the video file')
+    parser.add_argument('-N', type=int, default=8, help='the depth of the dyadic KServer')
+    parser.add_argument('--fps', type=float, default=5, help='the frame rate of the video')
+    parser.add_argument('--size', type=int, nargs=2, default=(1600, 900),
+                        metavar=('W', 'H'), help='the size of the frames in pixels')
+    parser.add_argument('--mass-scale', type=float, default=0.7,
+                        help='the display scale of the mass function')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='the number of worker processes, 0 for one per CPU')
+    args = parser.parse_args(argv)
+    options = {'N': args.N, 'workers': args.workers or None, 'w': args.size[0],
+               'h': args.size[1], 'mass_scale': args.mass_scale}
+    if os.path.splitext(args.output)[1] != '':
+        count = export_video(args.sequence, args.output, fps=args.fps, **options)
+    else:
+        count = sum(1 for _ in export_frames(args.sequence, args.output, **options))
+    print('%d frames written to %s' % (count, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,10 @@
 from basic import *
+from mass import *
+from concurrent.futures import ProcessPoolExecutor
+import gc
+import json
+import os
+import numpy as np
 
 
 class KServer:
@@ -8,17 +14,23 @@ class KServer:
     Attributes:
         semi_clusterings (:obj:`list` of :obj:`SemiClustering`): The sequence of semi-clusterings
         derived from the initial semi-partitions.
-        tree (:obj:`Tree` of :obj:`DoublyLinkedList` of :obj:`tuple`): The corresponding tree of
-        the sequence of the semi-clusterings. Each node of the tree is a list of 2-tuple
+        tree (:obj:`Tree` or :obj:`FlatTree`): The corresponding tree of the sequence of the
+        semi-clusterings. The data of each node of the tree is a list of 2-tuple
         (content, origin) where 'content' (:obj:`IntervalsSet`) represents a set and 'origin'
         (:obj:`IntervalsSet`) points to the interval set the content was derived from in the
-        semi-clusterings.
+        semi-clusterings. Nodes are accessed through the methods of the tree.
     """
 
-    def __init__(self, semi_partitions):
+    def __init__(self, semi_partitions, tree_type=Tree, workers=1, parallel_threshold=4096):
         """
         Args:
             semi_partitions (:obj:`list` of :obj:`SemiPartition`): A sequence of semi-partitions.
+            tree_type (:obj:`type`): The tree backend, either Tree (a tree of node objects)
+                or FlatTree (a compact array-backed tree). Default to Tree.
+            workers (int): The number of worker processes refining subtrees concurrently.
+                Default to 1, which refines the whole tree in this process.
+            parallel_threshold (int): The number of sets in the semi-partitions below which
+                the tree is refined in this process regardless of workers. Default to 4096.
         """
         # Semi-Clusterings
         self.semi_clusterings = []
@@ -31,24 +43,247 @@ class KServer:
         # Tree Structure
         root_set_origin = self.semi_clusterings[0].clusters[0].sets.first.data
         root_set = IntervalsSet([Interval(0, 1)]).intersect(root_set_origin)
-        self.tree = Tree(TreeNode(DoublyLinkedList([(root_set, root_set_origin)])))
-        self._init_tree(self.tree.root, 1)
+        self.tree = tree_type.with_root([(root_set, root_set_origin)])
+        self._journal = None
+        if workers > 1 and sum(len(sp.sets) for sp in semi_partitions) >= parallel_threshold:
+            self._init_tree_parallel(semi_partitions, workers)
+        else:
+            self._init_tree(self.tree.root, 1)
+
+    @classmethod
+    def dyadic(cls, N, tree_type=Tree):
+        """Form the KServer of the dyadic semi-partitions of [0, 1] up to depth N, where the
+        i-th semi-partition consists of the intervals [k / 2^i, (k + 1) / 2^i). The tree is
+        built directly from its known shape instead of by refinement.
+
+        Args:
+            N (int): The depth of the deepest semi-partition.
+            tree_type (:obj:`type`): The tree backend. Default to Tree.
+
+        Returns:
+            :obj:`KServer`: The same KServer as formed from the dyadic semi-partitions.
+        """
+        ks = cls.__new__(cls)
+        ks.semi_clusterings = []
+        levels = []
+        for i in range(N + 1):
+            count = 2**i
+            lefts = np.arange(count) / count
+            rights = np.arange(1, count + 1) / count
+            sets = [IntervalsSet.from_arrays(lefts[k:k + 1], rights[k:k + 1])
+                    for k in range(count)]
+            ks.semi_clusterings.append(SemiClustering([Cluster([s]) for s in sets]))
+            levels.append(sets)
+
+        root_set = levels[0][0]
+        ks.tree = tree_type.with_root([(root_set, root_set)])
+        ks._journal = None
+        nodes = [ks.tree.root]
+        for i in range(1, N + 1):
+            sets = levels[i]
+            children = []
+            for k in range(len(nodes)):
+                for intervals_set in (sets[2 * k], sets[2 * k + 1]):
+                    children.append(ks.tree.add_child(nodes[k],
+                                                      [(intervals_set, intervals_set)]))
+            nodes = children
+        return ks
+
+    def clone(self):
+        """Copy the KServer. The intervals sets, which are never modified, are shared with
+        the copy.
+
+        Returns:
+            :obj:`KServer`: The copy.
+        """
+        ks = KServer.__new__(KServer)
+        ks.semi_clusterings = [sc.copy() for sc in self.semi_clusterings]
+        ks.tree = self.tree.copy()
+        ks._journal = None
+        return ks
+
+    def snapshot(self):
+        """Take a snapshot of the current state. From the first snapshot on, the
+        semi-clusterings and the tree record how to undo their modifications, so that
+        restoring a snapshot takes time proportional to the modifications made since,
+        instead of rebuilding or cloning the whole KServer.
+
+        Returns:
+            int: The snapshot, to be passed to restore.
+        """
+        if self._journal == None:
+            self._journal = Journal()
+            for semi_clustering in self.semi_clusterings:
+                semi_clustering.journal = self._journal
+            self.tree.journal = self._journal
+        return self._journal.mark()
+
+    def restore(self, snapshot):
+        """Restore the state of a snapshot. The snapshot stays valid, and so do the
+        snapshots taken before it, while those taken after it are discarded.
+
+        Args:
+            snapshot (int): A snapshot returned by snapshot.
+
+        Raises:
+            Exception: If no snapshot has been taken.
+        """
+        if self._journal == None:
+            raise Exception('no snapshot to restore')
+        self._journal.rollback(snapshot)
+
+    def save(self, path):
+        """Save the KServer to a file, to be read back by load. The file consists of flat
+        arrays: the intervals of the sets of the semi-clusterings along with the number of
+        intervals of each set, of sets of each cluster and of clusters of each level, and
+        the nodes of the tree packed in pre-order by _serialize_nodes, whose origins are
+        the positions of the sets in their level.
+
+        Args:
+            path (str): The path of the file.
+        """
+        lefts, rights, set_sizes, cluster_sizes, level_sizes = cluster_structure(self)
+        origin_ids = []
+        for semi_clustering in self.semi_clusterings:
+            ids = {}
+            for cluster in semi_clustering.clusters:
+                for intervals_set in cluster.sets:
+                    ids[intervals_set] = len(ids)
+            origin_ids.append(ids)
+        nodes = []
+        stack = [(self.tree.root, 0, -1)]
+        while len(stack) > 0:
+            node, level, parent = stack.pop()
+            nodes.append((parent, level, self.tree.data(node)))
+            for child in reversed(self.tree.children(node)):
+                stack.append((child, level + 1, len(nodes) - 1))
+        arrays = {'lefts': lefts, 'rights': rights, 'set_sizes': set_sizes,
+                  'cluster_sizes': cluster_sizes, 'level_sizes': level_sizes}
+        arrays.update(zip(_TREE_ARRAYS, _serialize_nodes(nodes, origin_ids)))
+        _write_arrays(path, arrays)
+
+    @classmethod
+    def load(cls, path, tree_type=Tree, mmap=True):
+        """Load a KServer saved by save. Nothing is refined: the semi-clusterings and the
+        tree are built directly from the arrays of the file.
+
+        Args:
+            path (str): The path of the file.
+            tree_type (:obj:`type`): The tree backend. Default to Tree.
+            mmap (bool): Whether to map the file into memory instead of reading it. The
+                endpoints of the sets are then views of the mapping, which are read from
+                the file on first access and shared by all processes loading the file.
+                Default to True.
+
+        Returns:
+            :obj:`KServer`: The KServer.
+
+        Raises:
+            Exception: If the file is not a saved KServer.
+        """
+        arrays = _read_arrays(path, mmap)
+        # the objects built are all kept, so collecting while building them is wasted work
+        enabled = gc.isenabled()
+        gc.disable()
+        try:
+            return cls._from_arrays(arrays, tree_type)
+        finally:
+            if enabled:
+                gc.enable()
+
+    @classmethod
+    def _from_arrays(cls, arrays, tree_type):
+        lefts = arrays['lefts']
+        rights = arrays['rights']
+        set_sizes = arrays['set_sizes']
+        interval_starts = np.concatenate(([0], np.cumsum(set_sizes))).tolist()
+        sets = [IntervalsSet.from_arrays(lefts[start:end], rights[start:end])
+                for start, end in zip(interval_starts, interval_starts[1:])]
+        owners = np.repeat(np.arange(len(sets)), set_sizes)
+        cluster_ends = np.cumsum(arrays['cluster_sizes']).tolist()
+
+        ks = cls.__new__(cls)
+        ks.semi_clusterings = []
+        level_sets = []
+        first_cluster = 0
+        end = 0
+        for level_end in np.cumsum(arrays['level_sizes']).tolist():
+            first = end
+            clusters = []
+            for cluster_end in cluster_ends[first_cluster:level_end]:
+                clusters.append(Cluster(sets[end:cluster_end]))
+                end = cluster_end
+            first_cluster = level_end
+            # the interval index of the level, sorted by left endpoint
+            low, high = interval_starts[first], interval_starts[end]
+            order = np.argsort(lefts[low:high], kind='stable')
+            ks.semi_clusterings.append(SemiClustering.from_index(
+                clusters, lefts[low:high][order].tolist(), rights[low:high][order].tolist(),
+                [sets[k] for k in owners[low:high][order].tolist()]))
+            level_sets.append(sets[first:end])
+        ks.tree = tree_type.from_arrays(tuple(arrays[name] for name in _TREE_ARRAYS),
+                                        level_sets)
+        ks._journal = None
+        return ks
 
     def _init_tree(self, node, next_level):
+        stack = [(node, next_level)]
+        while len(stack) > 0:
+            node, next_level = stack.pop()
+            for child in self._add_children(node, next_level):
+                stack.append((child, next_level + 1))
+
+    def _add_children(self, node, next_level):
+        """Refine the given node by the semi-clustering of the next level.
+
+        Returns:
+            :obj:`list`: The children added to the node.
+        """
+        children = []
         if next_level < len(self.semi_clusterings):
             semi_clustering = self.semi_clusterings[next_level]
-            for cluster in semi_clustering.clusters:
-                child_data = DoublyLinkedList([])
+            node_data = self.tree.data(node)
+            candidates = {}
+            for t in node_data:
+                for cluster in semi_clustering.clusters_overlapping(t[0]):
+                    candidates[semi_clustering.order(cluster)] = cluster
+            for key in sorted(candidates):
+                cluster = candidates[key]
+                child_data = []
                 for intervals_set in cluster.sets:
-                    for t in node.data:
+                    for t in node_data:
                         content = intervals_set.intersect(t[0])
                         if content != None:
-                            child_data.push_back((content, intervals_set))
-                if not child_data.is_empty():
-                    node.add_child(child_data)
-
-            for child in node.children:
-                self._init_tree(child, next_level + 1)
+                            child_data.append((content, intervals_set))
+                if len(child_data) > 0:
+                    children.append(self.tree.add_child(node, child_data))
+        return children
+
+    def _init_tree_parallel(self, semi_partitions, workers):
+        """Refine the top levels of the tree in this process until there are a few subtrees
+        per worker, then refine the subtrees in worker processes and stitch them in. The
+        semi-partitions are sent to each worker once, and the subtrees travel in the compact
+        form of _serialize_nodes.
+        """
+        frontier = [(self.tree.root, 1)]
+        while 0 < len(frontier) < 4 * workers:
+            expanded = []
+            for node, next_level in frontier:
+                for child in self._add_children(node, next_level):
+                    expanded.append((child, next_level + 1))
+            frontier = expanded
+        if len(frontier) == 0:
+            return
+        origin_ids = [{s: k for k, s in enumerate(sp.sets)} for sp in semi_partitions]
+        tasks = [_serialize_nodes([(-1, next_level - 1, self.tree.data(node))], origin_ids)
+                 for node, next_level in frontier]
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_refinement_worker,
+                                 initargs=(semi_partitions,)) as executor:
+            for (node, _), subtree in zip(frontier, executor.map(_refine_subtree, tasks)):
+                handles = []
+                for parent, _, data in _deserialize_nodes(subtree, semi_partitions):
+                    handles.append(self.tree.add_child(node if parent == -1 else handles[parent],
+                                                       data))
 
     def insert(self, j, interval):
         """Insert the given interval into the j-th semi-clustering.
@@ -60,33 +295,74 @@ class KServer:
         Raises:
             Exception: If the entire interval has already existed in the j-th semi-clustering.
         """
-        complement = interval_complement_semi_clustering(interval, self.semi_clusterings[j])
-        if complement == None:
-            raise Exception('interval already existed')
-
-        self.semi_clusterings[j].clusters.append(Cluster([complement]))
-        self._insert(self.tree.root, 1, j, complement)
-
-    def _insert(self, node, next_level, target_level, intervals_set):
-        if next_level == target_level:
-            child_data = DoublyLinkedList([])
-            for t in node.data:
-                content = intervals_set.intersect(t[0])
-                if content != None:
-                    child_data.push_back((content, intervals_set))
-            if not child_data.is_empty():
-                node.add_child(child_data)
-                self._init_tree(node.children[len(node.children) - 1], next_level + 1)
-        else:
-            for child in node.children:
-                flag = False
-                for t in child.data:
-                    intersection = intervals_set.intersect(t[0])
-                    if intersection != None:
-                        flag = True
-                        break
-                if flag:
-                    self._insert(child, next_level + 1, target_level, intervals_set)
+        self.insert_many([(j, interval)])
+
+    def insert_many(self, ops):
+        """Insert a batch of intervals. The result is identical to calling insert on each
+        pair in order, but the tree is traversed once per level of the batch.
+
+        Args:
+            ops (:obj:`list` of :obj:`tuple`): The (j, interval) pairs to be inserted.
+
+        Raises:
+            Exception: If the entire interval of a pair has already existed in its
+            semi-clustering when the pair is reached. The pairs before it are inserted.
+        """
+        complements = {}
+        try:
+            for j, interval in ops:
+                complement = interval_complement_semi_clustering(interval,
+                                                                 self.semi_clusterings[j])
+                if complement == None:
+                    raise Exception('interval already existed')
+                self.semi_clusterings[j].add_cluster(Cluster([complement]))
+                complements.setdefault(j, []).append(complement)
+        finally:
+            # Deeper levels first: subtrees grown for a shallower level are built by
+            # _init_tree from the updated semi-clusterings and must not be visited again.
+            for j in sorted(complements, reverse=True):
+                self._insert(self.tree.root, 1, j, complements[j])
+            self.tree.reclaim()
+
+    def _insert(self, node, next_level, target_level, intervals_sets):
+        stack = [(node, next_level, intervals_sets)]
+        while len(stack) > 0:
+            node, next_level, intervals_sets = stack.pop()
+            if next_level == target_level:
+                node_data = self.tree.data(node)
+                for intervals_set in intervals_sets:
+                    child_data = []
+                    for t in node_data:
+                        content = intervals_set.intersect(t[0])
+                        if content != None:
+                            child_data.append((content, intervals_set))
+                    if len(child_data) > 0:
+                        self._init_tree(self.tree.add_child(node, child_data), next_level + 1)
+            else:
+                for child in self.tree.children(node):
+                    overlapping = self._overlapping_sets(child, intervals_sets)
+                    if len(overlapping) > 0:
+                        stack.append((child, next_level + 1, overlapping))
+
+    def _overlapping_sets(self, node, intervals_sets):
+        """Select the sets that overlap the content of the given node.
+
+        Args:
+            node: A node of the tree.
+            intervals_sets (:obj:`list` of :obj:`IntervalsSet`): The candidate sets.
+
+        Returns:
+            :obj:`list` of :obj:`IntervalsSet`: The sets overlapping some content of the
+            node, in the given order.
+        """
+        result = []
+        node_data = self.tree.data(node)
+        for intervals_set in intervals_sets:
+            for t in node_data:
+                if intervals_set.overlaps(t[0]):
+                    result.append(intervals_set)
+                    break
+        return result
 
     def delete(self, j, x):
         """Delete the set in the j-th semi-clustering that contains the given value x.
@@ -95,51 +371,91 @@ class KServer:
             j (int): The index of the semi-clustering.
             x (float): A given value.
         """
-        semi_clustering = self.semi_clusterings[j]
-        removed_set = None
-        for clt in semi_clustering.clusters:
-            try:
-                removed_set = clt.remove(x)
-                if removed_set != None:
-                    break
-            except:
-                removed_set = clt.sets.first.data
-                semi_clustering.clusters.remove(clt)
-                break
-        if removed_set == None:
-            raise Exception('no set contains specified value')
-
-        self._delete(self.tree.root, 1, j, removed_set)
-
-    def _delete(self, node, next_level, target_level, intervals_set):
-        if next_level < target_level:
-            for child in node.children:
-                flag = False
-                for t in child.data:
-                    intersection = intervals_set.intersect(t[0])
-                    if intersection != None:
-                        flag = True
-                        break
-                if flag:
-                    self._delete(child, next_level + 1, target_level, intervals_set)
-        else:
-            for child in node.children:
-                remaining = DoublyLinkedList([])
-                flag = False
-                for t in child.data:
-                    intersection = intervals_set.intersect(t[0])
-                    if intersection == None:
-                        remaining.push_back(t)
-                    else:
-                        flag = True
-                child.data = remaining
-                if not child.data.is_empty() and flag:
-                    self._delete(child, next_level + 1, target_level, intervals_set)
-            remaining = []
-            for child in node.children:
-                if not child.data.is_empty():
-                    remaining.append(child)
-            node.children = remaining
+        self.delete_many([(j, x)])
+
+    def delete_many(self, ops):
+        """Delete a batch of sets. The result is identical to calling delete on each pair
+        in order, but the tree is traversed once per level of the batch.
+
+        Args:
+            ops (:obj:`list` of :obj:`tuple`): The (j, x) pairs specifying the sets to be
+                deleted.
+
+        Raises:
+            Exception: If no set contains x in the j-th semi-clustering when a pair is
+            reached. The sets of the pairs before it are deleted.
+        """
+        removed_sets = {}
+        try:
+            for j, x in ops:
+                semi_clustering = self.semi_clusterings[j]
+                removed_set = semi_clustering.find_set(x)
+                if removed_set == None:
+                    raise Exception('no set contains specified value')
+                semi_clustering.remove_set(removed_set)
+                removed_sets.setdefault(j, []).append(removed_set)
+        finally:
+            for j in sorted(removed_sets):
+                self._delete(self.tree.root, 1, j, removed_sets[j])
+            self.tree.reclaim()
+
+    def apply_batch(self, ops):
+        """Apply a batch of insertions and deletions with the same result as applying them
+        one by one in order. Consecutive operations of the same kind are applied together
+        with insert_many or delete_many.
+
+        Args:
+            ops (:obj:`list` of :obj:`tuple`): The operations, each either
+                ('insert', j, interval) or ('delete', j, x).
+
+        Raises:
+            Exception: If an operation is unknown or fails. The operations before it
+            are applied.
+        """
+        methods = {'insert': self.insert_many, 'delete': self.delete_many}
+        kind = None
+        run = []
+        for op in ops:
+            if op[0] != kind:
+                if run:
+                    methods[kind](run)
+                    run = []
+                if op[0] not in methods:
+                    raise Exception('unknown operation: ' + str(op[0]))
+                kind = op[0]
+            run.append(op[1:])
+        if run:
+            methods[kind](run)
+
+    def _delete(self, node, next_level, target_level, intervals_sets):
+        stack = [(node, next_level, intervals_sets)]
+        while len(stack) > 0:
+            node, next_level, intervals_sets = stack.pop()
+            if next_level < target_level:
+                for child in self.tree.children(node):
+                    overlapping = self._overlapping_sets(child, intervals_sets)
+                    if len(overlapping) > 0:
+                        stack.append((child, next_level + 1, overlapping))
+            else:
+                remaining_children = []
+                for child in self.tree.children(node):
+                    overlapping = self._overlapping_sets(child, intervals_sets)
+                    if len(overlapping) > 0:
+                        remaining = []
+                        for t in self.tree.data(child):
+                            flag = False
+                            for intervals_set in overlapping:
+                                if intervals_set.overlaps(t[0]):
+                                    flag = True
+                                    break
+                            if not flag:
+                                remaining.append(t)
+                        if len(remaining) == 0:
+                            continue
+                        self.tree.set_data(child, remaining)
+                        stack.append((child, next_level + 1, overlapping))
+                    remaining_children.append(child)
+                self.tree.set_children(node, remaining_children)
 
     def fusion(self, p, a, b):
         """Perform fusion on two clusters in a semi-clustering.
@@ -154,73 +470,59 @@ class KServer:
         """
         if a == b:
             raise Exception('cannot fuse a cluster and itself')
-        clusters = self.semi_clusterings[p].clusters
-        clusters[a].sets.extend(clusters[b].sets)
-        new_cluster = clusters[a]
-        clusters.remove(clusters[b])
+        new_cluster = self.semi_clusterings[p].fuse(a, b)
 
         self._fusion(self.tree.root, 1, p, new_cluster)
+        self.tree.reclaim()
 
     def _fusion(self, node, next_level, target_level, cluster):
-        if next_level == target_level:
-            self._fuse(node, next_level)
-        elif next_level < target_level:
-            for child in node.children:
-                flag = False
-                for t in child.data:
-                    for intervals_set in cluster.sets:
-                        if intervals_set.intersect(t[0]) != None:
-                            flag = True
+        stack = [(node, next_level)]
+        while len(stack) > 0:
+            node, next_level = stack.pop()
+            if next_level == target_level:
+                self._fuse(node, next_level)
+            elif next_level < target_level:
+                for child in self.tree.children(node):
+                    flag = False
+                    for t in self.tree.data(child):
+                        for intervals_set in cluster.sets:
+                            if intervals_set.overlaps(t[0]):
+                                flag = True
+                                break
+                        if flag:
                             break
                     if flag:
-                        break
-                if flag:
-                    self._fusion(child, next_level + 1, target_level, cluster)
+                        stack.append((child, next_level + 1))
 
     def _fuse(self, node, next_level):
-        child_and_clusters = []
-        for child in node.children:
-            intervals_set = child.data.first.data[1]
-            child_and_clusters.append((child, self._find_cluster(next_level, intervals_set)))
-        child_and_clusters.sort(key=lambda e: e[1])
-        new_children = []
-        i = 0
-        while i < len(child_and_clusters) - 1:
-            if child_and_clusters[i][1] == child_and_clusters[i + 1][1]:
-                child1 = child_and_clusters[i][0]
-                child2 = child_and_clusters[i + 1][0]
-                child1.data.extend(child2.data)
-                child1.children.extend(child2.children)
-                new_children.append(child1)
-                self._fuse(child1, next_level + 1)
+        stack = [(node, next_level)]
+        while len(stack) > 0:
+            node, next_level = stack.pop()
+            children = self.tree.children(node)
+            if len(children) == 0:
+                continue
+            semi_clustering = self.semi_clusterings[next_level]
+            child_and_clusters = []
+            for child in children:
+                cluster = semi_clustering.cluster_of(self.tree.first(child)[1])
+                child_and_clusters.append((child, semi_clustering.order(cluster)))
+            child_and_clusters.sort(key=lambda e: e[1])
+            new_children = []
+            i = 0
+            while i < len(child_and_clusters) - 1:
+                if child_and_clusters[i][1] == child_and_clusters[i + 1][1]:
+                    child1 = child_and_clusters[i][0]
+                    child2 = child_and_clusters[i + 1][0]
+                    self.tree.merge(child1, child2)
+                    new_children.append(child1)
+                    stack.append((child1, next_level + 1))
+                    i += 1
+                else:
+                    new_children.append(child_and_clusters[i][0])
                 i += 1
-            else:
+            if i < len(child_and_clusters):
                 new_children.append(child_and_clusters[i][0])
-            i += 1
-        if i < len(child_and_clusters):
-            new_children.append(child_and_clusters[i][0])
-        node.children = new_children
-
-    def _find_cluster(self, j, intervals_set):
-        """Find the cluster which the given set in the j-th semi-clustering is in.
-
-        Args:
-            j (int): The index of the semi-clustering.
-            intervals_set (:obj:`IntervalsSet`): The given set.
-
-        Returns:
-            int: The index of the cluster in the j-th semi-clustering.
-
-        Raises:
-            Exception: If the given set is not in the j-th semi-clustering.
-        """
-        semi_clustering = self.semi_clusterings[j]
-        for i in range(len(semi_clustering.clusters)):
-            cluster = semi_clustering.clusters[i]
-            for s in cluster.sets:
-                if s is intervals_set:
-                    return i
-        raise Exception('no such intervals set in the j-th semi-clustering')
+            self.tree.set_children(node, new_children)
 
     def fission(self, p, a):
         """Perform fission on a cluster in a semi-clustering.
@@ -229,56 +531,57 @@ class KServer:
             p (int): The index of the semi-clustering in the sequence of semi-clusterings.
             a (int): The index of the cluster in the semi-clustering.
         """
-        clusters = self.semi_clusterings[p].clusters
-        removed_cluster = clusters[a]
-        for intervals_set in removed_cluster.sets:
-            clusters.append(Cluster([intervals_set]))
-        clusters.remove(removed_cluster)
+        removed_cluster = self.semi_clusterings[p].split(a)
 
         self._fission(self.tree.root, 1, p, removed_cluster)
+        self.tree.reclaim()
 
     def _fission(self, node, next_level, target_level, cluster):
-        if next_level == target_level:
-            flag = False
-            for child in node.children:
-                for t in child.data:
-                    for intervals_set in cluster.sets:
-                        if intervals_set.intersect(t[0]) != None:
-                            fission_child = child
-                            flag = True
+        stack = [(node, next_level)]
+        while len(stack) > 0:
+            node, next_level = stack.pop()
+            if next_level == target_level:
+                flag = False
+                for child in self.tree.children(node):
+                    for t in self.tree.data(child):
+                        for intervals_set in cluster.sets:
+                            if intervals_set.overlaps(t[0]):
+                                fission_child = child
+                                flag = True
+                                break
+                        if flag:
                             break
                     if flag:
                         break
-                if flag:
-                    break
-            data = list(fission_child.data)
-            data.sort(key=lambda t: id(t[1]))
-            new_nodes_data = []
-            start = None
-            for i in range(len(data)):
-                if i == 0:
-                    start = 0
-                elif not (data[i][1] is data[start][1]):
-                    new_nodes_data.append(data[start:i])
-                    start = i
-            new_nodes_data.append(data[start:len(data)])
-            node.children.remove(fission_child)
-            for node_data in new_nodes_data:
-                node.add_child(DoublyLinkedList(node_data))
-                self._init_tree(node.children[len(node.children) - 1], next_level + 1)
-
-        elif next_level < target_level:
-            for child in node.children:
-                flag = False
-                for t in child.data:
-                    for intervals_set in cluster.sets:
-                        if intervals_set.intersect(t[0]) != None:
-                            flag = True
+                data = list(self.tree.data(fission_child))
+                data.sort(key=lambda t: id(t[1]))
+                new_nodes_data = []
+                start = None
+                for i in range(len(data)):
+                    if i == 0:
+                        start = 0
+                    elif not (data[i][1] is data[start][1]):
+                        new_nodes_data.append(data[start:i])
+                        start = i
+                new_nodes_data.append(data[start:len(data)])
+                children = list(self.tree.children(node))
+                children.remove(fission_child)
+                self.tree.set_children(node, children)
+                for node_data in new_nodes_data:
+                    self._init_tree(self.tree.add_child(node, node_data), next_level + 1)
+
+            elif next_level < target_level:
+                for child in self.tree.children(node):
+                    flag = False
+                    for t in self.tree.data(child):
+                        for intervals_set in cluster.sets:
+                            if intervals_set.overlaps(t[0]):
+                                flag = True
+                                break
+                        if flag:
                             break
                     if flag:
-                        break
-                if flag:
-                    self._fission(child, next_level + 1, target_level, cluster)
+                        stack.append((child, next_level + 1))
 
     # work for specific trees only (2^(-i))
     # Generator: Each call fuse a heavy interval until all are fused
@@ -287,28 +590,64 @@ class KServer:
         heavy_list = []
         self._find_heavy(self.tree.root, mass, alpha, r, 0, heavy_list)
         for (level, itv) in heavy_list:
-            length = 2**(-level)
-            left_itv = Interval(itv.left - length, itv.left)
-            right_itv = Interval(itv.right, itv.right + length)
-            a = self._find_cluster_including_interval(level, itv)
-            b = self._find_cluster_including_interval(level, left_itv)
-            if a is not None and b is not None:
-                self.fusion(level, a, b)
-            a = self._find_cluster_including_interval(level, itv)
-            b = self._find_cluster_including_interval(level, right_itv)
-            if a is not None and b is not None:
-                self.fusion(level, a, b)
-
+            self._fuse_heavy(level, itv)
             yield 'level=%d, itv=[%f, %f]' % (level, itv.left, itv.right)
 
-    def _find_heavy(self, node, mass, alpha, r, level, heavy_list):
-        itv = node.data.first.data[0].data[0]
+    def _fuse_heavy(self, level, itv):
         length = 2**(-level)
-        mass_in_N = mass(Interval(itv.left - r * length, itv.right + r * length))
-        if mass(itv) > alpha * mass_in_N:
-            heavy_list.append((level, itv))
-        for child in node.children:
-            self._find_heavy(child, mass, alpha, r, level + 1, heavy_list)
+        left_itv = Interval(itv.left - length, itv.left)
+        right_itv = Interval(itv.right, itv.right + length)
+        a = self._find_cluster_including_interval(level, itv)
+        b = self._find_cluster_including_interval(level, left_itv)
+        if a is not None and b is not None:
+            self.fusion(level, a, b)
+        a = self._find_cluster_including_interval(level, itv)
+        b = self._find_cluster_including_interval(level, right_itv)
+        if a is not None and b is not None:
+            self.fusion(level, a, b)
+
+    def _find_heavy(self, node, mass, alpha, r, level, heavy_list):
+        nodes = self._node_intervals(node, level)
+        levels = np.array([level for level, _ in nodes], dtype=int)
+        lefts, rights, n_lefts, n_rights = self._neighbourhoods(nodes, r)
+        masses = level_masses(mass, np.concatenate((levels, levels)),
+                              np.concatenate((lefts, n_lefts)),
+                              np.concatenate((rights, n_rights)))
+        heavy = masses[:len(nodes)] > alpha * masses[len(nodes):]
+        for i in np.flatnonzero(heavy).tolist():
+            heavy_list.append(nodes[i])
+
+    def _node_intervals(self, node, level):
+        """The first interval of each node of the subtree at the given node, in pre-order.
+
+        Returns:
+            :obj:`list` of :obj:`tuple`: The (level, interval) pairs.
+        """
+        result = []
+        stack = [(node, level)]
+        while len(stack) > 0:
+            node, level = stack.pop()
+            result.append((level, self.tree.first(node)[0].data[0]))
+            for child in reversed(self.tree.children(node)):
+                stack.append((child, level + 1))
+        return result
+
+    def _neighbourhoods(self, nodes, r):
+        """The endpoints of the given intervals and of their neighbourhoods of radius r
+        times the length of their level.
+
+        Args:
+            nodes (:obj:`list` of :obj:`tuple`): The (level, interval) pairs.
+            r (float): The radius.
+
+        Returns:
+            :obj:`tuple` of :obj:`numpy.ndarray`: The left and right endpoints of the
+            intervals, followed by those of the neighbourhoods.
+        """
+        lefts = np.array([itv.left for _, itv in nodes], dtype=float)
+        rights = np.array([itv.right for _, itv in nodes], dtype=float)
+        lengths = np.ldexp(1.0, -np.array([level for level, _ in nodes], dtype=int))
+        return lefts, rights, lefts - r * lengths, rights + r * lengths
 
     def _find_cluster_including_interval(self, j, itv):
         """Find the cluster in j-th semi-clustering that includes the given interval.
@@ -321,14 +660,7 @@ class KServer:
             int: The index of the cluster in the j-th semi-clustering.
             None: If no cluster include the given interval.
         """
-        sc = self.semi_clusterings[j]
-        for i in range(len(sc.clusters)):
-            cluster = sc.clusters[i]
-            for s in cluster.sets:
-                for interval in s.data:
-                    if itv.left >= interval.left and itv.right <= interval.right:
-                        return i
-        return None
+        return self.semi_clusterings[j].find_cluster_including(itv)
 
 
     def print_tree(self):
@@ -337,15 +669,14 @@ class KServer:
         print()
 
     def _print_tree(self, node, level):
-        output = "    " * level
-        output += str(node.data.first.data[0])
-        curr = node.data.first.next
-        while curr != None:
-            output += "-" + str(curr.data[0])
-            curr = curr.next
-        print(output)
-        for child in node.children:
-            self._print_tree(child, level + 1)
+        stack = [(node, level)]
+        while len(stack) > 0:
+            node, level = stack.pop()
+            output = "    " * level
+            output += "-".join(str(t[0]) for t in self.tree.data(node))
+            print(output)
+            for child in reversed(self.tree.children(node)):
+                stack.append((child, level + 1))
 
     def __str__(self):
         """List the sequence of semi-clusterings as a string."""
@@ -353,3 +684,306 @@ class KServer:
         for sc in self.semi_clusterings:
             output += str(sc) + '\n'
         return output
+
+
+def cluster_structure(kserver):
+    """Read the clusters of each semi-clustering of a KServer into flat arrays.
+
+    Args:
+        kserver (:obj:`KServer`): The KServer.
+
+    Returns:
+        :obj:`tuple` of :obj:`numpy.ndarray`: The lefts, rights, set_sizes, cluster_sizes
+        and level_sizes arrays, as in FrameResult.
+    """
+    lefts = []
+    rights = []
+    set_sizes = []
+    cluster_sizes = []
+    level_sizes = []
+    for semi_clustering in kserver.semi_clusterings:
+        for cluster in semi_clustering.clusters:
+            count = 0
+            for s in cluster.sets:
+                lefts.append(s.left)
+                rights.append(s.right)
+                set_sizes.append(len(s.left))
+                count += 1
+            cluster_sizes.append(count)
+        level_sizes.append(len(semi_clustering.clusters))
+    return (np.concatenate(lefts) if len(lefts) > 0 else np.empty(0),
+            np.concatenate(rights) if len(rights) > 0 else np.empty(0),
+            np.array(set_sizes, dtype=int), np.array(cluster_sizes, dtype=int),
+            np.array(level_sizes, dtype=int))
+
+
+def _serialize_nodes(nodes, origin_ids):
+    """Pack nodes into flat arrays, identifying the origins of their data by their
+    positions in the semi-partitions.
+
+    Args:
+        nodes (:obj:`list` of :obj:`tuple`): The (parent, level, data) triples of the nodes,
+            where parent is the position of the parent node in the list, or -1.
+        origin_ids (:obj:`list` of :obj:`dict`): The position of each set in the
+            semi-partition of each level.
+
+    Returns:
+        :obj:`tuple` of :obj:`numpy.ndarray`: The parents and levels of the nodes, the number
+        of data entries of each node, the origin and the number of intervals of each entry,
+        and the endpoints of the intervals.
+    """
+    parents = []
+    levels = []
+    entry_counts = []
+    origins = []
+    interval_counts = []
+    lefts = []
+    rights = []
+    for parent, level, data in nodes:
+        parents.append(parent)
+        levels.append(level)
+        count = 0
+        for content, origin in data:
+            origins.append(origin_ids[level][origin])
+            interval_counts.append(len(content.left))
+            lefts.append(content.left)
+            rights.append(content.right)
+            count += 1
+        entry_counts.append(count)
+    return (np.array(parents, dtype=int), np.array(levels, dtype=int),
+            np.array(entry_counts, dtype=int), np.array(origins, dtype=int),
+            np.array(interval_counts, dtype=int),
+            np.concatenate(lefts) if len(lefts) > 0 else np.empty(0),
+            np.concatenate(rights) if len(rights) > 0 else np.empty(0))
+
+
+def _deserialize_nodes(serialized, semi_partitions):
+    """Unpack nodes packed by _serialize_nodes.
+
+    Args:
+        serialized (:obj:`tuple` of :obj:`numpy.ndarray`): The packed nodes.
+        semi_partitions (:obj:`list` of :obj:`SemiPartition`): The semi-partitions whose
+            sets the origins are restored to.
+
+    Returns:
+        :obj:`list` of :obj:`tuple`: The (parent, level, data) triples of the nodes.
+    """
+    parents, levels, entry_counts, origins, interval_counts, lefts, rights = serialized
+    origins = origins.tolist()
+    interval_counts = interval_counts.tolist()
+    result = []
+    entry = 0
+    start = 0
+    for parent, level, count in zip(parents.tolist(), levels.tolist(), entry_counts.tolist()):
+        sets = semi_partitions[level].sets
+        data = []
+        for _ in range(count):
+            end = start + interval_counts[entry]
+            data.append((IntervalsSet.from_arrays(lefts[start:end], rights[start:end]),
+                         sets[origins[entry]]))
+            entry += 1
+            start = end
+        result.append((parent, level, data))
+    return result
+
+
+_TREE_ARRAYS = ('node_parents', 'node_levels', 'entry_counts', 'entry_origins',
+                'interval_counts', 'entry_lefts', 'entry_rights')
+_FILE_MAGIC = b'KSERVER\x00'
+_FILE_VERSION = 1
+_FILE_ALIGNMENT = 64
+
+
+def _aligned(offset):
+    return -(-offset // _FILE_ALIGNMENT) * _FILE_ALIGNMENT
+
+
+def _write_arrays(path, arrays):
+    """Write named arrays to a file. The file starts with a magic string, the length of a
+    JSON header and the header, which gives the type, shape and offset of each array. The
+    data of the arrays follows in little-endian order, each array aligned to a multiple of
+    _FILE_ALIGNMENT bytes so that it can be viewed in place when the file is mapped.
+
+    Args:
+        path (str): The path of the file.
+        arrays (:obj:`dict`): The arrays by name.
+    """
+    specs = {}
+    data = []
+    offset = 0
+    for name, values in arrays.items():
+        values = np.ascontiguousarray(values)
+        values = values.astype(values.dtype.newbyteorder('<'), copy=False)
+        specs[name] = {'dtype': values.dtype.str, 'shape': list(values.shape),
+                       'offset': offset}
+        data.append(values)
+        offset = _aligned(offset + values.nbytes)
+    header = json.dumps({'version': _FILE_VERSION, 'arrays': specs}).encode()
+    prefix = _FILE_MAGIC + len(header).to_bytes(8, 'little') + header
+    # a KServer loaded from the file may be viewing it through a mapping, so the file is
+    # replaced rather than rewritten, leaving the mapped data intact
+    temp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        with open(temp_path, 'wb') as f:
+            f.write(prefix + bytes(_aligned(len(prefix)) - len(prefix)))
+            for values in data:
+                f.write(values.tobytes())
+                f.write(bytes(_aligned(values.nbytes) - values.nbytes))
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def _read_arrays(path, mmap):
+    """Read the arrays of a file written by _write_arrays.
+
+    Args:
+        path (str): The path of the file.
+        mmap (bool): Whether to map the file into memory instead of reading it.
+
+    Returns:
+        :obj:`dict`: The arrays by name, as views of the mapped or read file.
+
+    Raises:
+        Exception: If the file was not written by _write_arrays.
+    """
+    with open(path, 'rb') as f:
+        if f.read(len(_FILE_MAGIC)) != _FILE_MAGIC:
+            raise Exception('invalid file: not a saved KServer')
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length))
+    if header['version'] != _FILE_VERSION:
+        raise Exception('invalid file: unsupported version ' + str(header['version']))
+    if mmap:
+        buffer = np.memmap(path, dtype=np.uint8, mode='r').view(np.ndarray)
+    else:
+        buffer = np.fromfile(path, dtype=np.uint8)
+    start = _aligned(len(_FILE_MAGIC) + 8 + length)
+    arrays = {}
+    for name, spec in header['arrays'].items():
+        dtype = np.dtype(spec['dtype'])
+        offset = start + spec['offset']
+        size = int(np.prod(spec['shape'])) * dtype.itemsize
+        arrays[name] = buffer[offset:offset + size].view(dtype).reshape(spec['shape'])
+    return arrays
+
+
+_refinement_worker = None
+
+
+def _init_refinement_worker(semi_partitions):
+    global _refinement_worker
+    ks = KServer.__new__(KServer)
+    ks.semi_clusterings = [SemiClustering([Cluster([s]) for s in sp.sets])
+                           for sp in semi_partitions]
+    ks._journal = None
+    origin_ids = [{s: k for k, s in enumerate(sp.sets)} for sp in semi_partitions]
+    _refinement_worker = (ks, semi_partitions, origin_ids)
+
+
+def _refine_subtree(serialized):
+    """Refine the subtree at a node packed by _serialize_nodes in a worker process.
+
+    Returns:
+        :obj:`tuple` of :obj:`numpy.ndarray`: The descendants of the node, packed in
+        pre-order with the parents of the children of the node set to -1.
+    """
+    ks, semi_partitions, origin_ids = _refinement_worker
+    _, level, data = _deserialize_nodes(serialized, semi_partitions)[0]
+    ks.tree = Tree.with_root(data)
+    ks._init_tree(ks.tree.root, level + 1)
+    nodes = []
+    stack = [(child, level + 1, -1) for child in reversed(ks.tree.children(ks.tree.root))]
+    while len(stack) > 0:
+        node, level, parent = stack.pop()
+        nodes.append((parent, level, ks.tree.data(node)))
+        for child in reversed(ks.tree.children(node)):
+            stack.append((child, level + 1, len(nodes) - 1))
+    return _serialize_nodes(nodes, origin_ids)
+
+
+class HeavyTracker:
+    """Fuse the heavy clusters of a KServer for a sequence of mass functions, reusing the
+    work done for the previous mass function.
+
+    The heavy nodes are those of the tree at the time the tracker is formed, as in
+    fuse_heavy_generator. A node is only re-tested when its r-neighbourhood contains a point
+    whose mass changed: the heaviness test compares two masses, so scaling the whole
+    distribution does not affect it. The fusions of the heavy nodes shared with the
+    previous heavy list are kept, and the rest are undone with a snapshot and replayed.
+
+    Attributes:
+        kserver (:obj:`KServer`): The KServer whose clusters are fused. It must not be
+            modified or restored outside of the tracker.
+        heavy_list (:obj:`list` of :obj:`tuple`): The (level, interval) pairs of the heavy
+            nodes of the last mass function, in the order of fuse_heavy_generator.
+    """
+
+    def __init__(self, kserver, alpha, r):
+        """
+        Args:
+            kserver (:obj:`KServer`): The KServer whose clusters are fused.
+            alpha (float): The heaviness threshold, as in fuse_heavy_generator.
+            r (float): The neighbourhood radius, as in fuse_heavy_generator.
+        """
+        self.kserver = kserver
+        self.alpha = alpha
+        self.baseline = kserver.snapshot()
+        self.nodes = kserver._node_intervals(kserver.tree.root, 0)
+        levels = np.array([level for level, _ in self.nodes], dtype=int)
+        lefts, rights, n_lefts, n_rights = kserver._neighbourhoods(self.nodes, r)
+        self._depth = int(np.max(levels))
+        self._levels = np.concatenate((levels, levels))
+        self._lefts = np.concatenate((lefts, n_lefts))
+        self._rights = np.concatenate((rights, n_rights))
+        self._location = None
+        self._heavy = None
+        self._heavy_nodes = []
+        self._marks = []
+        self.heavy_list = []
+
+    def update(self, mass, changes=None):
+        """Fuse the heavy clusters for the given mass function, starting from the state of
+        the KServer when the tracker was formed.
+
+        Args:
+            mass (:obj:`callable`): The mass function of half-closed intervals.
+            changes (:obj:`list` of float): The points whose mass differs from the previous
+                mass function. `None` to re-test all nodes.
+        """
+        count = len(self.nodes)
+        if self._heavy is None or changes is None:
+            self._heavy = np.zeros(count, dtype=bool)
+            retest = np.arange(count)
+        else:
+            points = np.sort(np.asarray(changes, dtype=float))
+            inside = (np.searchsorted(points, self._rights[count:])
+                      - np.searchsorted(points, self._lefts[count:]))
+            retest = np.flatnonzero(inside)
+        if 2**self._depth <= 2 * len(retest):
+            if self._location is None:
+                self._location = MassPyramid.locate(self._depth, self._levels, self._lefts,
+                                                    self._rights)
+            masses = mass_pyramid(mass, self._depth).lookup(self._location, self._lefts,
+                                                            self._rights)
+            masses = np.concatenate((masses[:count][retest], masses[count:][retest]))
+        else:
+            both = np.concatenate((retest, retest + count))
+            masses = level_masses(mass, self._levels[both], self._lefts[both],
+                                  self._rights[both])
+        self._heavy[retest] = masses[:len(retest)] > self.alpha * masses[len(retest):]
+        heavy_nodes = np.flatnonzero(self._heavy).tolist()
+
+        kept = 0
+        while (kept < len(heavy_nodes) and kept < len(self._heavy_nodes)
+               and heavy_nodes[kept] == self._heavy_nodes[kept]):
+            kept += 1
+        self.kserver.restore(self._marks[kept - 1] if kept > 0 else self.baseline)
+        del self._marks[kept:]
+        for i in heavy_nodes[kept:]:
+            self.kserver._fuse_heavy(*self.nodes[i])
+            self._marks.append(self.kserver.snapshot())
+        self._heavy_nodes = heavy_nodes
+        self.heavy_list = [self.nodes[i] for i in heavy_nodes]
@@ -1,36 +1,42 @@
 from basic import *
 from kserver import *
+from mass import *
+from raster import *
 from tkinter import *
+import collections
+import itertools
 import random
-import bisect
 import time
-import matplotlib
-import matplotlib.cm as cm
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 
 
-class Drawing(Frame):
+class Drawing(Frame, Layout):
+    """The drawing of the mass function and the tree of a KServer.
 
-    def __init__(self, master=None, mass_scale=0.7):
+    By default the drawing is rasterized into an image with array operations and shown as
+    a single canvas image, updated at most once per pass of the event loop. Otherwise each
+    bar of the mass function and each interval of each node is a canvas item of its own,
+    and each drawing only updates the items that differ from the previous one: the nodes
+    are identified by their level and the pixels of their intervals, so a node that keeps
+    its shape is at most recolored, and the items of the nodes and lines that disappear
+    are moved to those that appear before any item is created or deleted.
+
+    Attributes:
+        raster (:obj:`Raster`): The rasterized drawing. `None` if canvas items are drawn.
+        changes (:obj:`collections.Counter`): The number of canvas items created, moved,
+            recolored and deleted since the last call to pop_changes.
+    """
+
+    def __init__(self, master=None, mass_scale=0.7, raster=True):
         super().__init__(master)
         self.pack()
 
-        self.w = master.winfo_width()
-        self.h = master.winfo_height()
+        Layout.__init__(self, master.winfo_width(), master.winfo_height(), mass_scale)
         self.canvas = Canvas(self, bg='white')
         self.canvas.pack(fill='both', expand=True)
 
-        self.scale = self._scale(1500, type='w')
-        self.x0 = self._scale(50, type='w')
-        self.y0 = self._scale(200, type='h')
-        self.node_height = self._scale(50, type='h')
-        self.level_gap = self._scale(25, type='h')
-        self.mass_y0 = self._scale(150, type='h')
-        self.mass_height = self._scale(100, type='h')
-        self.mass_width = self._scale(4, type='w')
-        self.mass_scale = mass_scale
-
         self.node_border_color = 'white'
-        self.node_border_width = self._scale(2, type='w')
 
         tmp_width = self._scale(4)
         self.canvas.create_line(self.x0, self.mass_y0,
@@ -46,108 +52,233 @@ class Drawing(Frame):
         self.canvas.create_text(self.x0 - space_width, self.mass_y0 - self.mass_height,
                                 text=str(self.mass_scale), font=("Courier", font_size))
 
-        self.cmap = cm.get_cmap('YlGnBu')
+        self.colors = color_table('YlGnBu')
+
+        self.raster = None
+        if raster:
+            self.raster = Raster(self, self.colors)
+            self._photo = PhotoImage(master=self.canvas, width=self.w, height=self.h)
+            self.canvas.create_image(0, 0, anchor='nw', image=self._photo, tags='raster')
+            self.canvas.tag_lower('raster')
+            self._blit_pending = False
+        self.changes = collections.Counter()
+        self._bars = None
+        self._bar_tops = None
+        self._node_items = {}
+        self._edge_items = {}
+
+    def _schedule_blit(self):
+        if not self._blit_pending:
+            self._blit_pending = True
+            self.after_idle(self._blit)
+
+    def _blit(self):
+        self._blit_pending = False
+        self._photo.configure(data=self.raster.ppm(), format='PPM')
 
     def draw_mass(self, mass_f):
-        self.canvas.delete('mass')
-        for i in range(self.scale):
-            m = mass_f(Interval(i / self.scale, (i+1) / self.scale))
-            self.canvas.create_line(self.x0 + i, self.mass_y0,
-                                    self.x0 + i,
-                                    self.mass_y0 - self.mass_height * m / self.mass_scale,
-                                    fill='blue', width=self.mass_width, tags='mass')
+        if self.raster != None:
+            self.raster.draw_mass(mass_f)
+            self._schedule_blit()
+            return
+        masses = batch_mass(mass_f, np.arange(self.scale) / self.scale,
+                            np.arange(1, self.scale + 1) / self.scale)
+        tops = self.mass_y0 - self.mass_height * masses / self.mass_scale
+        if self._bars == None:
+            self._bars = [self.canvas.create_line(self.x0 + i, self.mass_y0,
+                                                  self.x0 + i, top,
+                                                  fill='blue', width=self.mass_width,
+                                                  tags='mass')
+                          for i, top in enumerate(tops.tolist())]
+            self.changes['created'] += len(self._bars)
+        else:
+            for i in np.flatnonzero(tops != self._bar_tops).tolist():
+                self.canvas.coords(self._bars[i], self.x0 + i, self.mass_y0,
+                                   self.x0 + i, float(tops[i]))
+                self.changes['moved'] += 1
+        self._bar_tops = tops
 
     def draw_tree(self, tree, mass_f, s_alpha):
-        self.canvas.delete('tree')
-        self._draw_tree(tree.root, 0, mass_f, s_alpha)
-
-    def _draw_tree(self, node, level, mass_f, s_alpha):
-        mid_pos = self._draw_node(node, level, mass_f, s_alpha)
-        y_stop = self.y0 + (level + 1) * (self.node_height + self.level_gap)
-        y_start = y_stop - self.level_gap
-        for child in node.children:
-            self.canvas.create_line(mid_pos, y_start,
-                                    self._draw_tree(child, level + 1, mass_f, s_alpha),
-                                    y_stop, tags='tree')
-        return mid_pos
-
-    def _draw_node(self, node, level, mass_f, s_alpha):
-        mid_pos = None
-        mass = 0
-        for e in node.data:
-            for itv in e[0].data:
-                mass += mass_f(itv)
-        if mass < s_alpha:
-            col_string = '#b3b6b7'      # gray
-        else:
-            col_string = self._mass2color(mass)
-        left_border = self.w
-        right_border = 0
+        nodes = tree_nodes(tree)
+        self.draw_nodes(nodes, node_masses(nodes, mass_f), s_alpha)
+
+    def draw_nodes(self, nodes, masses, s_alpha):
+        """Draw the nodes of a tree given their masses, without accessing the tree.
+
+        Args:
+            nodes (:obj:`list` of :obj:`tuple`): The nodes, as returned by tree_nodes.
+            masses (:obj:`numpy.ndarray`): The mass of each node.
+            s_alpha (float): The mass below which nodes are drawn in light gray.
+        """
+        if self.raster != None:
+            self.raster.draw_tree(nodes, masses, s_alpha)
+            self._schedule_blit()
+            return
+        self._update_tree(nodes, masses, s_alpha)
+
+    def pop_changes(self):
+        """Return the numbers of canvas items changed since the last call and reset them.
+
+        Returns:
+            :obj:`collections.Counter`: The numbers of items 'created', 'moved',
+            'recolored' and 'deleted'.
+        """
+        changes = self.changes
+        self.changes = collections.Counter()
+        return changes
+
+    def _update_tree(self, nodes, masses, s_alpha):
+        shapes = {}
+        edges = []
+        mids = []
+        colors = [self.colors.hex[k] for k in self.colors.index(masses).tolist()]
+        for (node_data, level, parent), mass, color in zip(nodes, masses.tolist(), colors):
+            rects = []
+            for e in node_data:
+                for itv in e[0].data:
+                    left = self.x0 + int(itv.left * self.scale)
+                    rects.append((left, self.x0 + int(itv.right * self.scale)))
+                    if len(rects) == 1:
+                        mids.append(left + int((itv.right - itv.left) / 2 * self.scale))
+            if len(rects) == 0:
+                mids.append(None)
+            if mass < s_alpha:
+                color = '#b3b6b7'       # gray
+            shapes[(level, tuple(rects))] = color
+            if parent != -1:
+                edges.append((level, mids[parent], mids[-1]))
+
+        # the items of the nodes and lines that disappear, by kind
+        free = {'node': [], 'border': [], 'edge': []}
+        for key in [key for key in self._node_items if key not in shapes]:
+            _, rects, borders = self._node_items.pop(key)
+            free['node'] += rects
+            free['border'] += borders
+        edge_keys = set(edges)
+        for key in [key for key in self._edge_items if key not in edge_keys]:
+            free['edge'].append(self._edge_items.pop(key))
+
+        created = self.changes['created']
+        for key, color in shapes.items():
+            items = self._node_items.get(key)
+            if items == None:
+                self._node_items[key] = self._place_node(key, color, free)
+            elif items[0] != color:
+                for item in items[1]:
+                    self.canvas.itemconfigure(item, fill=color)
+                self.changes['recolored'] += len(items[1])
+                self._node_items[key] = (color, items[1], items[2])
+        for key in edges:
+            if key not in self._edge_items:
+                level, x_start, x_stop = key
+                y_stop = self.y0 + level * (self.node_height + self.level_gap)
+                self._edge_items[key] = self._place(free, 'edge', (x_start, y_stop -
+                                                    self.level_gap, x_stop, y_stop))
+        for items in free.values():
+            for item in items:
+                self.canvas.delete(item)
+                self.changes['deleted'] += 1
+        if self.changes['created'] != created:
+            # new items are created on top, so the borders and lines are raised above them
+            self.canvas.tag_raise('border')
+            self.canvas.tag_raise('edge')
+
+    def _place_node(self, key, color, free):
+        level, rects = key
         upper = self.y0 + level * (self.node_height + self.level_gap)
         lower = upper + self.node_height
-        for e in node.data:         # TODO: change mid_pos calculation
-            content = e[0]
-            for itv in content.data:
-                if mid_pos is None:
-                    mid_pos = self.x0 + int(itv.left * self.scale) + \
-                              int((itv.right - itv.left) / 2 * self.scale)
-                left = self.x0 + int(itv.left * self.scale)
-                right = self.x0 + int(itv.right * self.scale)
-                left_border = min(left_border, left)
-                right_border = max(right_border, right)
-                self.canvas.create_rectangle(left, upper, right, lower,
-                                             fill=col_string, width=0, tags='tree')
-                self.canvas.create_line(left, upper, right, upper,
-                                        fill=self.node_border_color,
-                                        width=self.node_border_width, tags='tree')
-                self.canvas.create_line(left, lower, right, lower,
-                                        fill=self.node_border_color,
-                                        width=self.node_border_width, tags='tree')
-        self.canvas.create_line(left_border, upper, left_border, lower,
-                                fill=self.node_border_color,
-                                width=self.node_border_width, tags='tree')
-        self.canvas.create_line(right_border, upper, right_border, lower,
-                                fill=self.node_border_color,
-                                width=self.node_border_width, tags='tree')
-        return mid_pos
-
-    def _mass2color(self, mass):
-        color = self.cmap(float(mass))
-        return matplotlib.colors.rgb2hex(color[:3])
-
-    def _scale(self, length, type='m'):
-        w = self.w * length / 1600
-        h = self.h * length / 900
-        if type == 'w':
-            return round(w)
-        elif type == 'h':
-            return round(h)
+        rect_items = []
+        border_items = []
+        left_border = self.w
+        right_border = 0
+        for left, right in rects:
+            rect_items.append(self._place(free, 'node', (left, upper, right, lower),
+                                          fill=color))
+            border_items.append(self._place(free, 'border', (left, upper, right, upper)))
+            border_items.append(self._place(free, 'border', (left, lower, right, lower)))
+            left_border = min(left_border, left)
+            right_border = max(right_border, right)
+        border_items.append(self._place(free, 'border',
+                                        (left_border, upper, left_border, lower)))
+        border_items.append(self._place(free, 'border',
+                                        (right_border, upper, right_border, lower)))
+        return color, rect_items, border_items
+
+    def _place(self, free, kind, coords, fill=None):
+        """Move a free item of a kind to the given coordinates, or create one."""
+        if len(free[kind]) > 0:
+            item = free[kind].pop()
+            self.canvas.coords(item, *coords)
+            if fill != None:
+                self.canvas.itemconfigure(item, fill=fill)
+            self.changes['moved'] += 1
+            return item
+        self.changes['created'] += 1
+        if kind == 'node':
+            return self.canvas.create_rectangle(*coords, fill=fill, width=0,
+                                                tags=('tree', 'node'))
+        elif kind == 'border':
+            return self.canvas.create_line(*coords, fill=self.node_border_color,
+                                           width=self.node_border_width,
+                                           tags=('tree', 'border'))
         else:
-            return round(min(w, h))
+            return self.canvas.create_line(*coords, tags=('tree', 'edge'))
 
 
 class App(Frame):
+    """The animation of the heavy clusters of a KServer for a sequence of mass functions.
+
+    The animation is driven by the Tk event loop: each frame is shown by an after callback
+    at its time at the target frame rate, while the next frame is fused by a worker thread.
+    When fusing falls behind, the frames whose time has passed are dropped. Closing the
+    window stops the animation and the worker.
+
+    Attributes:
+        fps (float): The target frame rate.
+        dropped (int): The number of frames of the sequence dropped so far, counted when
+            a frame is shown.
+    """
+
+    poll_interval = 5       # ms between checks for a frame still being fused
 
     def __init__(self, kserver, mass_f, big_alpha, small_alpha, r,
-                 master=None, mass_sequence=None, mass_scale=0.7):
+                 master=None, mass_sequence=None, mass_scale=0.7, mass_changes=None,
+                 raster=True, frame_hook=None, fps=5):
+        """
+        Args:
+            raster (bool): Whether the drawing is rasterized, as in Drawing. Default to
+                True.
+            frame_hook (:obj:`callable`): Called after each frame of the mass sequence
+                with its index, the seconds taken to fuse and draw it, and the numbers
+                of canvas items changed, as returned by Drawing.pop_changes.
+            fps (float): The target frame rate of the mass sequence. Default to 5.
+        """
         super().__init__(master)
         self.pack(fill='both', expand=True)
         self.root = master
 
         master.update()
-        self.drawing = Drawing(self, mass_scale=mass_scale)
+        self.drawing = Drawing(self, mass_scale=mass_scale, raster=raster)
         self.drawing.pack(side='left', fill='both', expand=True)
 
         self.kserver = kserver
+        self.tracker = HeavyTracker(kserver, big_alpha, r)
         self.mass = mass_f
         self.b_alpha = big_alpha
         self.s_alpha = small_alpha
         self.r = r
-        self.fhg = self.kserver.fuse_heavy_generator(self.mass, self.b_alpha, self.r)
         self._draw_mass()
         self._draw_tree()
 
         self.mass_sequence = mass_sequence
+        self.mass_changes = mass_changes
+        self.frame_hook = frame_hook
+        self.fps = fps
+        self.dropped = 0
+        self._executor = None
+        self._after = None
+        self._closed = False
+        self.root.protocol('WM_DELETE_WINDOW', self.close)
         if self.mass_sequence is not None:
             self._animate_mass_seq('<Button-1>')
 
@@ -158,105 +289,147 @@ class App(Frame):
         self.drawing.draw_tree(self.kserver.tree, self.mass, self.s_alpha)
 
     def _fuse_last(self):
-        for e in self.fhg:
-            None
+        self.tracker.update(self.mass)
 
     def _fuse_last_event(self, event):
         self._fuse_last()
         self._draw_tree()
 
+    def close(self):
+        """Stop the animation and destroy the window. The frame being fused, if any, is
+        abandoned rather than waited for.
+        """
+        self._closed = True
+        if self._after != None:
+            self.after_cancel(self._after)
+            self._after = None
+        if self._executor != None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+        self.root.destroy()
+
     def _animate_mass_seq(self, event):
         if self.mass_sequence is None:
             raise Exception('No input mass sequence')
-        try:
-            for mf in self.mass_sequence:
-                self.mass = mf
-                self.kserver = generate_kserver(len(self.kserver.semi_clusterings)-1)
-                self.fhg = self.kserver.fuse_heavy_generator(self.mass, self.b_alpha, self.r)
-                self._fuse_last()
-                self._draw_mass()
-                self._draw_tree()
-                self.drawing.canvas.update_idletasks()
-                time.sleep(0.2)
-        except KeyboardInterrupt:
-            self.root.destroy()
-
-
-def generate_kserver(N):
-
-    sps = []
-    sps.append([Interval(0, 1)])
-    for i in range(N):
-        intervals = []
-        for itv in sps[i]:
-            mid = (itv.left + itv.right) / 2
-            intervals.append(Interval(itv.left, mid))
-            intervals.append(Interval(mid, itv.right))
-        sps.append(intervals)
-    for sp in sps:
-        for i in range(len(sp)):
-            sp[i] = IntervalsSet([sp[i]])
-    sps = [SemiPartition(sp) for sp in sps]
-    return KServer(sps)
-
-
-def generate_mass_from_list(mass_list):
-    num = len(mass_list)
-    positions = [(2*i+1)/(2*num) for i in range(num)]
-
-    total = 0
-    for i in range(num):
-        total += mass_list[i]
-    mass_list = [m / total for m in mass_list]
-
-    prefix_sum = []
-    total = 0
-    for m in mass_list:
-        total += m
-        prefix_sum.append(total)
-
-    def mf(itv):     # itv half-closed [a, b)
-        """Mass contained in the given interval.
-
-        Args:
-            itv (:obj:`Interval`): The given interval.
+        if self.mass_changes is None:
+            self.mass_changes = itertools.repeat(None)
+        self._frames = enumerate(zip(self.mass_sequence, self.mass_changes))
+        self._last_index = -1
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._start = time.perf_counter()
+        self._future = self._executor.submit(self._fuse_frame, 0)
+        self._show_frame()
+
+    def _fuse_frame(self, index):
+        """Fuse the heavy clusters for the frame of an index in the worker thread, dropping
+        the frames before it that were not fused. The last frame of the sequence is fused
+        instead if the index is past its end.
 
         Returns:
-            int: The amount of mass contained in the interval.
+            :obj:`tuple`: The index, the mass function, the nodes of the tree as returned
+            by tree_nodes, their masses and the seconds taken, or `None` at the end of
+            the sequence or once the app is closed.
         """
-        points_list = positions
-        mass_prefix = prefix_sum
-        left = bisect.bisect_left(points_list, itv.left) - 1
-        right = bisect.bisect_left(points_list, itv.right) - 1
-        cum_mass_left = mass_prefix[left] if left >= 0 else 0
-        cum_mass_right = mass_prefix[right] if right >= 0 else 0
-        return cum_mass_right - cum_mass_left
+        start = time.perf_counter()
+        frame = None
+        for k, (mf, changes) in self._frames:
+            if self._closed:
+                return None
+            if frame != None:
+                # the changes are relative to the previous frame, which was dropped
+                changes = None
+            frame = k, mf, changes
+            if k == index:
+                break
+        if frame == None:
+            return None
+        index, mf, changes = frame
+        self.tracker.update(mf, changes)
+        # the data lists of the nodes are copied, as the next frame modifies them
+        nodes = [(list(data), level, parent)
+                 for data, level, parent in tree_nodes(self.kserver.tree)]
+        masses = node_masses(nodes, mf)
+        return index, mf, nodes, masses, time.perf_counter() - start
+
+    def _show_frame(self):
+        if not self._future.done():
+            self._after = self.after(self.poll_interval, self._show_frame)
+            return
+        self._after = None
+        frame = self._future.result()
+        if frame == None:
+            self._executor.shutdown(wait=False)
+            return
+        index, mf, nodes, masses, seconds = frame
+        # the frames between the last one shown and this one were skipped by the worker
+        self.dropped += index - self._last_index - 1
+        self._last_index = index
+        # fuse the first frame still due while this one is drawn
+        next_index = max(index + 1, int((time.perf_counter() - self._start) * self.fps) + 1)
+        self._future = self._executor.submit(self._fuse_frame, next_index)
+
+        start = time.perf_counter()
+        self.drawing.pop_changes()
+        self.mass = mf
+        self._draw_mass()
+        self.drawing.draw_nodes(nodes, masses, self.s_alpha)
+        self.drawing.canvas.update_idletasks()
+        if self.frame_hook != None:
+            self.frame_hook(index, seconds + time.perf_counter() - start,
+                            self.drawing.pop_changes())
+        delay = self._start + next_index / self.fps - time.perf_counter()
+        self._after = self.after(max(int(delay * 1000), 0), self._show_frame)
+
 
-    return mf
+def generate_kserver(N, tree_type=Tree):
+    return KServer.dyadic(N, tree_type)
 
 
-def animate_mass_sequence(sequence, mass_func_display_scale=0.7):
+def animate_mass_sequence(sequence, mass_func_display_scale=0.7, raster=True,
+                          frame_hook=None, fps=5):
     """Run visualization with an input sequence of mass distributions.
 
     Args:
-        sequence (:obj:`List` of `List`): The input sequence of mass
-        distributions. Each element of the outer list is a list specifying the
-        amount of mass. A list l of length n with total mass M represents a
-        distribution with Prob((2i+1)/(2n)) = l[i] / M .
+        sequence (:obj:`iterable` of `List` or str): The input sequence of mass
+        distributions. Each element is a list specifying the amount of mass. A
+        list l of length n with total mass M represents a distribution with
+        Prob((2i+1)/(2n)) = l[i] / M . The sequence may be a generator, or the
+        path of a CSV or .npy file read by load_mass_sequence; it is consumed
+        lazily, one distribution per frame.
         mass_func_display_scale (float): A real value between 0 and 1
         specifying the display scale of the mass function. Default to 0.7.
+        raster (bool): Whether the drawing is rasterized into an image rather than
+        drawn with a canvas item per shape. Default to True.
+        frame_hook (:obj:`callable`): Called after each frame with its index, the
+        seconds taken to fuse and draw it, and the numbers of canvas items
+        changed, as in App. Default to None.
+        fps (float): The target frame rate. Frames are dropped when they cannot
+        be fused in time. Default to 5.
     """
-    mass_func_sequence = [generate_mass_from_list(l) for l in sequence]
-    main(mass_func_sequence, mass_func_display_scale)
+    if isinstance(sequence, str):
+        sequence = load_mass_sequence(sequence)
+    lists, previous_lists = itertools.tee(sequence)
+    mass_func_sequence = (generate_mass_from_list(l) for l in lists)
+    mass_changes = mass_sequence_changes(previous_lists)
+    main(mass_func_sequence, mass_func_display_scale, mass_changes, raster, frame_hook,
+         fps)
 
 
-def main(mass_sequence, mass_func_display_scale=0.7):
+def main(mass_sequence, mass_func_display_scale=0.7, mass_changes=None, raster=True,
+         frame_hook=None, fps=5):
     ks = generate_kserver(8)
     root = Tk()
     root.title("Visualization")
     w, h = root.winfo_screenwidth(), root.winfo_screenheight()
     root.geometry("%dx%d+0+0" % (w, h))
-    app = App(ks, (mass_sequence[0] if len(mass_sequence) > 0 else None),
+    mass_sequence = iter(mass_sequence)
+    first = next(mass_sequence, None)
+    if first is not None:
+        mass_sequence = itertools.chain([first], mass_sequence)
+    app = App(ks, first,
               0.9, 0.01, 4, master=root, mass_sequence=mass_sequence,
-              mass_scale=mass_func_display_scale)
-    root.mainloop()
+              mass_scale=mass_func_display_scale, mass_changes=mass_changes,
+              raster=raster, frame_hook=frame_hook, fps=fps)
+    try:
+        root.mainloop()
+    except KeyboardInterrupt:
+        app.close()
@@ -0,0 +1,290 @@
+from basic import *
+import bisect
+import csv
+import numpy as np
+
+
+def batch_mass(mass, lefts, rights):
+    """Evaluate a mass function on the half-closed intervals [lefts[i], rights[i]) in one
+    call. Mass functions may provide a vectorized mass.batch(lefts, rights); other mass
+    functions are called on each interval.
+
+    Args:
+        mass (:obj:`callable`): The mass function of half-closed intervals.
+        lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals.
+        rights (:obj:`numpy.ndarray`): The right endpoints of the intervals.
+
+    Returns:
+        :obj:`numpy.ndarray`: The amounts of mass contained in the intervals.
+    """
+    lefts = np.asarray(lefts, dtype=float)
+    rights = np.asarray(rights, dtype=float)
+    batch = getattr(mass, 'batch', None)
+    if batch is not None:
+        return batch(lefts, rights)
+    return np.array([mass(Interval(left, right))
+                     for left, right in zip(lefts.tolist(), rights.tolist())], dtype=float)
+
+
+class MassPyramid:
+    """The masses of the dyadic intervals [k / 2^i, (k + 1) / 2^i) of levels 0 to N. The
+    masses of level N are evaluated in one batched call, and those of each coarser level
+    are the sums of pairs of the level below. The mass function is assumed to vanish
+    outside [0, 1].
+
+    The levels are stored one after another in a flat array, level i starting at 2^i - 1,
+    and so are their prefix sums, level i starting at 2^i - 1 + i.
+
+    Attributes:
+        levels (:obj:`list` of :obj:`numpy.ndarray`): The masses of the intervals of
+            each level.
+        prefix_sums (:obj:`list` of :obj:`numpy.ndarray`): The prefix sums of the masses
+            of each level, starting with 0.
+    """
+
+    def __init__(self, mass, N):
+        """
+        Args:
+            mass (:obj:`callable`): The mass function of half-closed intervals.
+            N (int): The finest level.
+        """
+        self.mass = mass
+        self.N = N
+        grid = np.arange(2**N + 1) / 2**N
+        levels = [batch_mass(mass, grid[:-1], grid[1:])]
+        for _ in range(N):
+            finer = levels[len(levels) - 1]
+            levels.append(finer[0::2] + finer[1::2])
+        levels.reverse()
+        self._masses = np.concatenate(levels)
+        self._prefix_sums = np.concatenate([np.concatenate(([0.0], np.cumsum(level)))
+                                            for level in levels])
+        self.levels = [self._masses[2**i - 1:2**(i + 1) - 1] for i in range(N + 1)]
+        self.prefix_sums = [self._prefix_sums[2**i - 1 + i:2**(i + 1) + i]
+                            for i in range(N + 1)]
+
+    def masses(self, levels, lefts, rights):
+        """Evaluate the mass of the half-closed intervals [lefts[i], rights[i]). An interval
+        whose endpoints are multiples of 2^(-levels[i]) is looked up in the arrays of its
+        level: directly if it is a single dyadic interval, by prefix sums otherwise. Other
+        intervals are passed to the mass function.
+
+        Args:
+            levels (:obj:`numpy.ndarray`): The levels of the intervals.
+            lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals.
+            rights (:obj:`numpy.ndarray`): The right endpoints of the intervals.
+
+        Returns:
+            :obj:`numpy.ndarray`: The amounts of mass contained in the intervals.
+        """
+        return self.lookup(MassPyramid.locate(self.N, levels, lefts, rights), lefts, rights)
+
+    @staticmethod
+    def locate(N, levels, lefts, rights):
+        """Locate intervals in the flat arrays of the pyramids of depth N. The location only
+        depends on the intervals, so it can be reused with the pyramid of every mass
+        function.
+
+        Args:
+            N (int): The finest level of the pyramids.
+            levels (:obj:`numpy.ndarray`): The levels of the intervals.
+            lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals.
+            rights (:obj:`numpy.ndarray`): The right endpoints of the intervals.
+
+        Returns:
+            :obj:`tuple` of :obj:`numpy.ndarray`: Whether each interval is looked up,
+            whether it is a single dyadic interval, its index in the masses, and the
+            indices of its endpoints in the prefix sums.
+        """
+        levels = np.minimum(np.asarray(levels, dtype=int), N + 1)
+        scales = np.ldexp(1.0, levels)
+        starts = np.asarray(lefts, dtype=float) * scales
+        stops = np.asarray(rights, dtype=float) * scales
+        aligned = (levels <= N) & (starts == np.floor(starts)) & (stops == np.floor(stops))
+        levels = np.where(aligned, levels, 0)
+        counts = np.left_shift(1, levels)
+        lo = np.where(aligned, np.clip(starts, 0, counts), 0).astype(int)
+        hi = np.where(aligned, np.clip(stops, 0, counts), 0).astype(int)
+        offsets = counts - 1
+        return (aligned, hi - lo == 1, offsets + np.minimum(lo, offsets),
+                offsets + levels + lo, offsets + levels + hi)
+
+    def lookup(self, location, lefts, rights):
+        """Evaluate the mass of intervals located by locate.
+
+        Args:
+            location (:obj:`tuple`): The location of the intervals.
+            lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals.
+            rights (:obj:`numpy.ndarray`): The right endpoints of the intervals.
+
+        Returns:
+            :obj:`numpy.ndarray`: The amounts of mass contained in the intervals.
+        """
+        aligned, single, cells, starts, stops = location
+        result = np.where(single, self._masses[cells],
+                          self._prefix_sums[stops] - self._prefix_sums[starts])
+        rest = ~aligned
+        if rest.any():
+            lefts = np.asarray(lefts, dtype=float)
+            rights = np.asarray(rights, dtype=float)
+            result[rest] = batch_mass(self.mass, lefts[rest], rights[rest])
+        return result
+
+
+def mass_pyramid(mass, N):
+    """The mass pyramid of the given mass function up to level N. Mass functions formed by
+    generate_mass_from_list keep their pyramids, so that the heavy cluster detection and
+    the drawing of a frame share them.
+
+    Args:
+        mass (:obj:`callable`): The mass function of half-closed intervals.
+        N (int): The finest level.
+
+    Returns:
+        :obj:`MassPyramid`: The pyramid.
+    """
+    pyramids = getattr(mass, 'pyramids', None)
+    if pyramids is None:
+        return MassPyramid(mass, N)
+    if N not in pyramids:
+        pyramids[N] = MassPyramid(mass, N)
+    return pyramids[N]
+
+
+def level_masses(mass, levels, lefts, rights):
+    """Evaluate a mass function on the half-closed intervals [lefts[i], rights[i]) of the
+    given levels of a tree. The mass pyramid is used when it is not larger than the number
+    of intervals, as for the nodes of a dyadic tree, and batch_mass otherwise.
+
+    Args:
+        mass (:obj:`callable`): The mass function of half-closed intervals.
+        levels (:obj:`numpy.ndarray`): The levels of the intervals.
+        lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals.
+        rights (:obj:`numpy.ndarray`): The right endpoints of the intervals.
+
+    Returns:
+        :obj:`numpy.ndarray`: The amounts of mass contained in the intervals.
+    """
+    if len(lefts) == 0 or 2**int(np.max(levels)) > len(lefts):
+        return batch_mass(mass, lefts, rights)
+    return mass_pyramid(mass, int(np.max(levels))).masses(levels, lefts, rights)
+
+
+def generate_mass_from_list(mass_list):
+    num = len(mass_list)
+    positions = [(2*i+1)/(2*num) for i in range(num)]
+
+    total = 0
+    for i in range(num):
+        total += mass_list[i]
+    mass_list = [m / total for m in mass_list]
+
+    prefix_sum = []
+    total = 0
+    for m in mass_list:
+        total += m
+        prefix_sum.append(total)
+
+    def mf(itv):     # itv half-closed [a, b)
+        """Mass contained in the given interval.
+
+        Args:
+            itv (:obj:`Interval`): The given interval.
+
+        Returns:
+            int: The amount of mass contained in the interval.
+        """
+        points_list = positions
+        mass_prefix = prefix_sum
+        left = bisect.bisect_left(points_list, itv.left) - 1
+        right = bisect.bisect_left(points_list, itv.right) - 1
+        cum_mass_left = mass_prefix[left] if left >= 0 else 0
+        cum_mass_right = mass_prefix[right] if right >= 0 else 0
+        return cum_mass_right - cum_mass_left
+
+    positions_array = np.array(positions)
+    prefix_array = np.array([0] + prefix_sum)
+
+    def batch(lefts, rights):
+        """Mass contained in each of the given half-closed intervals.
+
+        Args:
+            lefts (:obj:`numpy.ndarray`): The left endpoints of the intervals.
+            rights (:obj:`numpy.ndarray`): The right endpoints of the intervals.
+
+        Returns:
+            :obj:`numpy.ndarray`: The amounts of mass contained in the intervals.
+        """
+        return (prefix_array[np.searchsorted(positions_array, rights)]
+                - prefix_array[np.searchsorted(positions_array, lefts)])
+
+    mf.batch = batch
+    mf.pyramids = {}
+    return mf
+
+
+def mass_list_changes(old_list, new_list):
+    """Find the points whose mass differs between two lists given to generate_mass_from_list.
+    Since the heaviness of an interval does not depend on the total mass, the lists need
+    not be normalized alike.
+
+    Args:
+        old_list (:obj:`List` of float): The previous amounts of mass.
+        new_list (:obj:`List` of float): The current amounts of mass.
+
+    Returns:
+        :obj:`List` of float: The points of the changed masses. `None` if the lengths of the
+        lists differ, in which case every point moves.
+    """
+    num = len(new_list)
+    if len(old_list) != num:
+        return None
+    changed = np.flatnonzero(np.asarray(old_list) != np.asarray(new_list))
+    return ((2*changed+1)/(2*num)).tolist()
+
+
+def mass_sequence_changes(sequence):
+    """Lazily find the changed points between consecutive lists of a mass sequence, as in
+    mass_list_changes. Only the previous list is kept.
+
+    Args:
+        sequence (:obj:`iterable` of :obj:`List`): The sequence of mass lists.
+
+    Yields:
+        :obj:`List` of float: The changed points of each list. `None` for the first list.
+    """
+    previous = None
+    for mass_list in sequence:
+        yield None if previous is None else mass_list_changes(previous, mass_list)
+        previous = mass_list
+
+
+def load_mass_sequence(path, mmap=True):
+    """Stream a sequence of mass lists from a file, one list at a time, so that the
+    memory used does not depend on the length of the sequence.
+
+    A .npy file holds a 2-dimensional array whose rows are the mass lists, and is
+    memory-mapped unless mmap is False. Any other file is read as CSV with one mass list
+    per row.
+
+    Args:
+        path (str): The path of the file.
+        mmap (bool): Whether to memory-map a .npy file. Default to True.
+
+    Yields:
+        :obj:`List` of float: The mass lists.
+
+    Raises:
+        Exception: If a .npy file does not hold a 2-dimensional array.
+    """
+    if path.endswith('.npy'):
+        array = np.load(path, mmap_mode='r' if mmap else None)
+        if array.ndim != 2:
+            raise Exception('invalid mass sequence: expected a 2-dimensional array')
+        for row in array:
+            yield row.tolist()
+    else:
+        with open(path, newline='') as f:
+            for row in csv.reader(f):
+                if len(row) > 0:
+                    yield [float(x) for x in row]
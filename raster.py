@@ -0,0 +1,316 @@
+from basic import *
+from mass import *
+import numpy as np
+
+
+def tree_nodes(tree):
+    """Collect the nodes of a tree in pre-order.
+
+    Args:
+        tree (:obj:`Tree` or :obj:`FlatTree`): The tree.
+
+    Returns:
+        :obj:`list` of :obj:`tuple`: The (data, level, parent) triples of the nodes, where
+        parent is the position of the parent node in the list, or -1 for the root.
+    """
+    nodes = []
+    stack = [(tree.root, 0, -1)]
+    while len(stack) > 0:
+        node, level, parent = stack.pop()
+        nodes.append((tree.data(node), level, parent))
+        for child in reversed(tree.children(node)):
+            stack.append((child, level + 1, len(nodes) - 1))
+    return nodes
+
+
+def _node_intervals(nodes):
+    """The intervals of the contents of the nodes as endpoint arrays, along with the
+    position of the node of each interval. The intervals of a node are contiguous and in
+    the order of its data."""
+    lefts = []
+    rights = []
+    owners = []
+    for k, (node_data, _, _) in enumerate(nodes):
+        for content, _ in node_data:
+            lefts.append(content.left)
+            rights.append(content.right)
+            owners.append(np.full(len(content.left), k))
+    if len(lefts) == 0:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=int)
+    return np.concatenate(lefts), np.concatenate(rights), np.concatenate(owners)
+
+
+def node_masses(nodes, mass_f):
+    """Evaluate the mass of the contents of each node in one batched call.
+
+    Args:
+        nodes (:obj:`list` of :obj:`tuple`): The nodes, as returned by tree_nodes.
+        mass_f (:obj:`callable`): The mass function.
+
+    Returns:
+        :obj:`numpy.ndarray`: The mass of each node.
+    """
+    lefts, rights, owners = _node_intervals(nodes)
+    if len(owners) == 0:
+        return np.zeros(len(nodes))
+    levels = np.array([level for _, level, _ in nodes], dtype=int)
+    masses = level_masses(mass_f, levels[owners], lefts, rights)
+    return np.bincount(owners, weights=masses, minlength=len(nodes))
+
+
+class Layout:
+    """The positions and sizes in pixels of the elements of a drawing of the mass function
+    and the tree of a KServer, scaled from those of a 1600 x 900 drawing.
+
+    Attributes:
+        w (int): The width of the drawing.
+        h (int): The height of the drawing.
+        scale (int): The width of the interval [0, 1].
+        x0 (int): The position of 0.
+        y0 (int): The top of the root of the tree.
+        node_height (int): The height of a node.
+        level_gap (int): The space between two levels of the tree.
+        mass_y0 (int): The bottom of the mass function.
+        mass_height (int): The height of a bar of mass mass_scale.
+        mass_width (int): The width of a bar of the mass function.
+        mass_scale (float): The mass shown at the full height of the mass function.
+        node_border_width (int): The width of the borders of the nodes.
+    """
+
+    def __init__(self, w, h, mass_scale=0.7):
+        self.w = w
+        self.h = h
+        self.scale = self._scale(1500, type='w')
+        self.x0 = self._scale(50, type='w')
+        self.y0 = self._scale(200, type='h')
+        self.node_height = self._scale(50, type='h')
+        self.level_gap = self._scale(25, type='h')
+        self.mass_y0 = self._scale(150, type='h')
+        self.mass_height = self._scale(100, type='h')
+        self.mass_width = self._scale(4, type='w')
+        self.mass_scale = mass_scale
+        self.node_border_width = self._scale(2, type='w')
+
+    def _scale(self, length, type='m'):
+        w = self.w * length / 1600
+        h = self.h * length / 900
+        if type == 'w':
+            return round(w)
+        elif type == 'h':
+            return round(h)
+        else:
+            return round(min(w, h))
+
+
+class ColorTable:
+    """The colors of a matplotlib colormap as a lookup table, built once so that masses
+    are mapped to colors with array indexing rather than a call to the colormap for each
+    node. The table has as many entries as the colormap, so the colors are exactly those
+    of the colormap.
+
+    Attributes:
+        rgb (:obj:`numpy.ndarray`): The n x 3 array of the colors, in [0, 255].
+        hex (:obj:`list` of str): The colors as '#rrggbb' strings.
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): The name of the matplotlib colormap.
+        """
+        # matplotlib is imported on first use, as it is slow to import and not needed
+        # for computing without a drawing
+        import matplotlib
+        if hasattr(matplotlib, 'colormaps'):
+            cmap = matplotlib.colormaps[name]
+        else:
+            import matplotlib.cm as cm
+            cmap = cm.get_cmap(name)
+        rgba = np.asarray(cmap(np.arange(cmap.N)), dtype=float)
+        self.rgb = np.round(rgba[:, :3] * 255).astype(np.uint8)
+        self.hex = ['#%02x%02x%02x' % tuple(color) for color in self.rgb.tolist()]
+
+    def index(self, values):
+        """The entries of values in [0, 1], as in the colormap.
+
+        Args:
+            values (:obj:`numpy.ndarray`): The values.
+
+        Returns:
+            :obj:`numpy.ndarray`: The position of the color of each value in the table.
+        """
+        n = len(self.rgb)
+        return np.clip(np.asarray(values, dtype=float) * n, 0, n - 1).astype(int)
+
+
+_color_tables = {}
+
+
+def color_table(name='YlGnBu'):
+    """The ColorTable of a colormap, built on the first request.
+
+    Args:
+        name (str): The name of the matplotlib colormap. Default to 'YlGnBu'.
+
+    Returns:
+        :obj:`ColorTable`: The lookup table.
+    """
+    if name not in _color_tables:
+        _color_tables[name] = ColorTable(name)
+    return _color_tables[name]
+
+
+class Raster:
+    """An RGB image of the mass function and the tree of a KServer. Everything is drawn
+    with array operations on the whole image instead of one shape at a time, following
+    the canvas drawing of main.Drawing: the mass function as bars above the tree and each
+    node as a row of rectangles, one per interval, with white borders and a line from the
+    node to its parent.
+
+    Attributes:
+        layout (:obj:`Layout`): The size of the image and the positions and sizes of
+            the elements.
+        colors (:obj:`ColorTable`): The colors of the heavy nodes.
+        image (:obj:`numpy.ndarray`): The h x w x 3 array of the pixels. It is a view of
+            a buffer holding the image in the PPM format.
+    """
+
+    background = (255, 255, 255)
+    mass_color = (0, 0, 255)
+    light_color = (0xb3, 0xb6, 0xb7)
+    border_color = (255, 255, 255)
+    edge_color = (0, 0, 0)
+
+    def __init__(self, layout, colors):
+        self.layout = layout
+        self.colors = colors
+        header = b'P6 %d %d 255\n' % (layout.w, layout.h)
+        self._buffer = bytearray(len(header) + layout.h * layout.w * 3)
+        self._buffer[:len(header)] = header
+        self.image = np.frombuffer(self._buffer, dtype=np.uint8, offset=len(header)) \
+            .reshape(layout.h, layout.w, 3)
+        # filling from a row is much faster than from a color tuple
+        self._background = np.empty((layout.w, 3), dtype=np.uint8)
+        self._background[:] = Raster.background
+        self.image[:] = self._background
+
+    def draw_mass(self, mass_f):
+        """Draw the mass of each pixel column of [0, 1] as a bar, replacing the bars
+        drawn before.
+
+        Args:
+            mass_f (:obj:`callable`): The mass function.
+        """
+        layout = self.layout
+        bottom = min(layout.mass_y0, layout.h)
+        self.image[:bottom] = self._background
+        masses = batch_mass(mass_f, np.arange(layout.scale) / layout.scale,
+                            np.arange(1, layout.scale + 1) / layout.scale)
+        tops = layout.mass_y0 - layout.mass_height * masses / layout.mass_scale
+        # the bar of column i spans mass_width pixels centered on x0 + i
+        width = max(layout.mass_width, 1)
+        column_tops = np.full(layout.scale + width - 1, np.inf)
+        for d in range(width):
+            np.minimum(column_tops[d:d + layout.scale], tops,
+                       out=column_tops[d:d + layout.scale])
+        start = layout.x0 - width // 2
+        low = max(start, 0)
+        high = min(start + len(column_tops), layout.w)
+        if bottom <= 0 or low >= high:
+            return
+        column_tops = np.ceil(column_tops[low - start:high - start])
+        mask = np.arange(bottom)[:, None] >= column_tops[None, :]
+        self.image[:bottom, low:high][mask] = Raster.mass_color
+
+    def draw_tree(self, nodes, masses, s_alpha):
+        """Draw the nodes of a tree, replacing the tree drawn before.
+
+        Args:
+            nodes (:obj:`list` of :obj:`tuple`): The nodes, as returned by tree_nodes.
+            masses (:obj:`numpy.ndarray`): The mass of each node.
+            s_alpha (float): The mass below which nodes are drawn in light gray.
+        """
+        layout = self.layout
+        top = max(min(layout.mass_y0, layout.h), 0)
+        self.image[top:] = self._background
+        if len(nodes) == 0:
+            return
+        lefts, rights, owners = _node_intervals(nodes)
+        if len(owners) == 0:
+            return
+        levels = np.array([level for _, level, _ in nodes], dtype=int)
+        parents = np.array([parent for _, _, parent in nodes], dtype=int)
+        masses = np.asarray(masses, dtype=float)
+        colors = np.empty((len(nodes), 3), dtype=np.uint8)
+        colors[:] = Raster.light_color
+        heavy = masses >= s_alpha
+        colors[heavy] = self.colors.rgb[self.colors.index(masses[heavy])]
+
+        uppers = layout.y0 + levels * (layout.node_height + layout.level_gap)
+        x_lefts = layout.x0 + (lefts * layout.scale).astype(int)
+        x_rights = layout.x0 + (rights * layout.scale).astype(int)
+        has_intervals = np.bincount(owners, minlength=len(nodes)) > 0
+        firsts = np.searchsorted(owners, np.arange(len(nodes)))
+
+        # the intervals of a level are disjoint, so each level is a band of identical rows
+        widths = x_rights - x_lefts
+        columns = np.repeat(x_lefts - np.cumsum(widths) + widths, widths) + \
+            np.arange(widths.sum())
+        column_owners = np.repeat(owners, widths)
+        inside = (columns >= 0) & (columns < layout.w)
+        columns = columns[inside]
+        column_owners = column_owners[inside]
+        border = layout.node_border_width
+        row = np.empty((layout.w, 3), dtype=np.uint8)
+        for level in np.unique(levels).tolist():
+            upper = layout.y0 + level * (layout.node_height + layout.level_gap)
+            lower = upper + layout.node_height
+            in_level = levels[column_owners] == level
+            level_columns = columns[in_level]
+            row[:] = self._background
+            row[level_columns] = colors[column_owners[in_level]]
+            self.image[max(upper, 0):max(min(lower, layout.h), 0)] = row
+            for y in (upper, lower):
+                rows = np.arange(y - border // 2, y - border // 2 + border)
+                rows = rows[(rows >= 0) & (rows < layout.h)]
+                self.image[rows[:, None], level_columns[None, :]] = Raster.border_color
+
+        # the vertical borders at the ends of each node
+        starts = firsts[has_intervals]
+        node_uppers = uppers[has_intervals]
+        left_borders = np.minimum.reduceat(x_lefts, starts)
+        right_borders = np.maximum.reduceat(x_rights, starts)
+        rows = node_uppers[:, None] + np.arange(layout.node_height)[None, :]
+        for x in (left_borders, right_borders):
+            for d in range(border):
+                self._plot(rows, (x - border // 2 + d)[:, None], Raster.border_color)
+
+        # the lines from the middle of the first interval of each node to its parent
+        mids = x_lefts[firsts] + ((rights[firsts] - lefts[firsts]) / 2 * layout.scale).astype(int)
+        children = np.flatnonzero(parents != -1)
+        x_starts = mids[parents[children]]
+        x_stops = mids[children]
+        y_stops = uppers[children]
+        y_starts = y_stops - layout.level_gap
+        steps = np.maximum(np.maximum(np.abs(x_stops - x_starts), y_stops - y_starts), 1)
+        offsets = np.arange(steps.sum()) - np.repeat(np.cumsum(steps) - steps, steps)
+        t = (offsets + 0.5) / np.repeat(steps, steps)
+        xs = np.floor(np.repeat(x_starts, steps) +
+                      np.repeat(x_stops - x_starts, steps) * t).astype(int)
+        ys = np.floor(np.repeat(y_starts, steps) +
+                      np.repeat(y_stops - y_starts, steps) * t).astype(int)
+        self._plot(ys, xs, Raster.edge_color)
+
+    def _plot(self, rows, columns, color):
+        rows, columns = np.broadcast_arrays(rows, columns)
+        inside = (rows >= 0) & (rows < self.layout.h) & (columns >= 0) & \
+            (columns < self.layout.w)
+        self.image[rows[inside], columns[inside]] = color
+
+    def ppm(self):
+        """The image in the binary PPM format, which Tk photo images read directly.
+
+        Returns:
+            bytes: The PPM data.
+        """
+        return bytes(self._buffer)